@@ -1,13 +1,187 @@
-from gurobipy import *
+from array import array
+from collections.abc import Mapping, MutableMapping, ValuesView, ItemsView
+from solver import *
+
+#
+# The topology is stored as flat integer arrays over object ids in a
+# Topology: edge endpoints, tunnel and shortcut paths as CSR rows of edge
+# ids, and the reverse incidences (edge -> tunnels, edge -> shortcuts,
+# shortcut -> tunnels, demand -> tunnels) as id arrays. Tunnels, shortcuts
+# and demands are looked up by their id sequence through a SequenceIndex,
+# so no path strings and no per-tunnel Python objects are kept.
+#
+# Edge, Demand, Shortcut and Tunnel are thin views, an (owning network,
+# id) pair made on access, so callers such as tunnel.path, edge.tunnels
+# and network.tunnels[pathstr] keep working. Two views of the same object
+# of the same network compare equal and hash alike. Model variables
+# (v_flow, x_e_t, y_s, w_s) belong to the Network rather than the
+# Topology: Network.scenario_copy() returns a network that shares the
+# topology and only has variables of its own, which is all a
+# failure-scenario copy needs.
+#
+
+class SequenceIndex:
+    #
+    # Hash index from an integer tuple to the id it was added with, as
+    # chained buckets in two int arrays: a head per bucket and a link per
+    # id. Keys are not stored here; key(id) reads them back from the
+    # topology (None for a removed id). Tuples of ints hash alike in every
+    # process, so the index stays valid when pickled.
+    #
+    __slots__ = ('heads', 'links', 'count')
+
+    def __init__(self):
+        self.heads = array('i', [-1] * 8)
+        self.links = array('i')
+        self.count = 0
+
+    def find(self, seq, key):
+        i = self.heads[hash(seq) & (len(self.heads) - 1)]
+        while i >= 0:
+            if key(i) == seq:
+                return i
+            i = self.links[i]
+        return -1
+
+    def add(self, id, key):
+        # Ids are added in order 0, 1, 2, ...
+        assert id == len(self.links)
+        self.links.append(-1)
+        self.count += 1
+        if self.count > len(self.heads):
+            self.rehash(2 * len(self.heads), key)
+        else:
+            self.link(id, key(id))
+
+    def remove(self, id, key):
+        bucket = hash(key(id)) & (len(self.heads) - 1)
+        if self.heads[bucket] == id:
+            self.heads[bucket] = self.links[id]
+        else:
+            i = self.heads[bucket]
+            while self.links[i] != id:
+                i = self.links[i]
+            self.links[i] = self.links[id]
+        self.links[id] = -1
+        self.count -= 1
+
+    def link(self, id, seq):
+        bucket = hash(seq) & (len(self.heads) - 1)
+        self.links[id] = self.heads[bucket]
+        self.heads[bucket] = id
+
+    def rehash(self, size, key):
+        self.heads = array('i', [-1] * size)
+        for id in range(len(self.links)):
+            seq = key(id)
+            if seq is not None:
+                self.link(id, seq)
+
+class Topology:
+    #
+    # Shared storage of a network and its scenario copies:
+    # nodes           - market -> Node
+    # node_names      - market of each node id
+    # edge_index      - (market, market) -> edge id
+    # edge_src/dst    - endpoint node ids of each edge
+    # edge_unity, edge_capacity, edge_distance - per-edge values
+    # edge_tunnels    - tunnel ids on each edge, in insertion order
+    # edge_shortcuts  - shortcut ids on each edge, in insertion order
+    # tunnel_ptr/tunnel_edges     - CSR rows of edge ids along each tunnel
+    # shortcut_ptr/shortcut_edges - the same for shortcuts
+    # shortcut_unity, shortcut_distance - per-shortcut values
+    # shortcut_tunnels - tunnel ids each shortcut is in
+    # demand_src/dst/amount - per-demand values; demand_alive is 0 once
+    #                   a demand is deleted
+    # demand_head/tail, tunnel_next - each demand's tunnels as a linked
+    #                   list through the tunnel ids
+    #
+    __slots__ = ('nodes', 'node_names', 'edge_index', 'edge_src', 'edge_dst', 'edge_unity',
+                 'edge_capacity', 'edge_distance', 'edge_tunnels', 'edge_shortcuts',
+                 'tunnel_ptr', 'tunnel_edges', 'tunnel_index', 'tunnel_next',
+                 'shortcut_ptr', 'shortcut_edges', 'shortcut_index', 'shortcut_unity',
+                 'shortcut_distance', 'shortcut_tunnels',
+                 'demand_src', 'demand_dst', 'demand_amount', 'demand_alive', 'demand_head',
+                 'demand_tail', 'demand_index', 'num_demands', 'derived')
+
+    def __init__(self):
+        self.nodes = {}
+        self.node_names = []
+        self.edge_index = {}
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_unity = []
+        self.edge_capacity = []
+        self.edge_distance = []
+        self.edge_tunnels = []
+        self.edge_shortcuts = []
+        self.tunnel_ptr = array('i', [0])
+        self.tunnel_edges = array('i')
+        self.tunnel_index = SequenceIndex()
+        self.tunnel_next = array('i')
+        self.shortcut_ptr = array('i', [0])
+        self.shortcut_edges = array('i')
+        self.shortcut_index = SequenceIndex()
+        self.shortcut_unity = []
+        self.shortcut_distance = []
+        self.shortcut_tunnels = []
+        self.demand_src = array('i')
+        self.demand_dst = array('i')
+        self.demand_amount = array('d')
+        self.demand_alive = array('b')
+        self.demand_head = array('i')
+        self.demand_tail = array('i')
+        self.demand_index = SequenceIndex()
+        self.num_demands = 0
+        # TopologyArrays, dropped on every change
+        self.derived = None
+
+    def tunnel_row(self, t):
+        return tuple(self.tunnel_edges[self.tunnel_ptr[t]:self.tunnel_ptr[t + 1]])
+
+    def shortcut_row(self, s):
+        return tuple(self.shortcut_edges[self.shortcut_ptr[s]:self.shortcut_ptr[s + 1]])
+
+    def demand_key(self, d):
+        return (self.demand_src[d], self.demand_dst[d]) if self.demand_alive[d] else None
+
+    def path_row(self, hops):
+        # Edge ids along a list of markets, or None if a hop is no edge
+        row = []
+        for hop in zip(hops, hops[1:]):
+            edge = self.edge_index.get(hop)
+            if edge is None:
+                return None
+            row.append(edge)
+        return tuple(row)
+
+    def path_str(self, row):
+        names = self.node_names
+        return ':'.join([names[self.edge_src[row[0]]]] +
+                        [names[self.edge_dst[e]] for e in row])
+
+    def demand_tunnels(self, d):
+        ids = array('i')
+        t = self.demand_head[d]
+        while t >= 0:
+            ids.append(t)
+            t = self.tunnel_next[t]
+        return ids
+
+    def changed(self):
+        self.derived = None
 
 class Node:
+    __slots__ = ('id', 'mkt', 'latitude', 'longitude', 'devices', 'regions')
+
     def __init__(self, mkt):
+        self.id = None
         self.mkt = mkt
         self.latitude = None
         self.longitude = None
         self.devices = []
         self.regions = []
-        
+
     def update(self, device=None, region=None, latitude=None, longitude=None):
         if device and device not in self.devices:
             self.devices.append(device)
@@ -17,83 +191,251 @@ class Node:
             self.latitude = latitude
         if longitude:
             self.longitude = longitude
-            
-class Edge:
+
+class View:
+    # An object of a network, by id
+    __slots__ = ('network', 'id')
+
+    def __init__(self, network, id):
+        self.network = network
+        self.id = id
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.id == self.id and \
+            other.network is self.network
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.id})"
+
+class PathSet:
     #
-    # An Edge contains a Graph edge object.
-    # and additional attributes.
-    # shortcuts - List of shortcuts that the edge is a part of
-    # tunnels   - List of tunnels that he edge is part of
-    # x_e_t     - Traffic allocation on e for tunnel t
+    # Ordered, read-only collection of tunnels or shortcuts over an id
+    # array of the topology. The array is live, so the collection follows
+    # later additions. Membership is by view equality: an object of
+    # another network with the same pathstr is not "in".
     #
-    def __init__(self, e, unity, capacity):
-        self.e = e
-        self.unity    = unity
-        self.capacity = capacity
-        self.distance = None
-        self.shortcuts = []
-        self.tunnels = []
-        self.x_e_t = {}
+    __slots__ = ('network', 'kind', 'ids')
 
-    def add_shortcut(self, s):
-        assert self.e in [edge.e for edge in s.path]
-        if all(s.pathstr != x.pathstr for x in self.shortcuts):
-            self.shortcuts.append(s)
+    def __init__(self, network, kind, ids):
+        self.network = network
+        self.kind = kind
+        self.ids = ids
+
+    def get(self, pathstr, default=None):
+        table = self.network.tunnels if self.kind is Tunnel else self.network.shortcuts
+        x = table.get(pathstr)
+        return x if x is not None and x.id in self.ids else default
+
+    def has_path(self, pathstr):
+        return self.get(pathstr) is not None
+
+    def __contains__(self, x):
+        return type(x) is self.kind and x.network is self.network and x.id in self.ids
+
+    def __iter__(self):
+        network, kind = self.network, self.kind
+        return (kind(network, i) for i in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        return self.kind(self.network, self.ids[idx])
+
+    def __repr__(self):
+        return f"PathSet({[x.pathstr for x in self]})"
+
+class VarMap(MutableMapping):
+    # Variables of a network keyed by tunnel, stored by tunnel id
+    __slots__ = ('network', 'vars')
+
+    def __init__(self, network, vars):
+        self.network = network
+        self.vars = vars
+
+    def __getitem__(self, tunnel):
+        return self.vars[tunnel.id]
+
+    def __setitem__(self, tunnel, var):
+        self.vars[tunnel.id] = var
+
+    def __delitem__(self, tunnel):
+        del self.vars[tunnel.id]
+
+    def __iter__(self):
+        network = self.network
+        return (Tunnel(network, t) for t in self.vars)
+
+    def __len__(self):
+        return len(self.vars)
+
+    def values(self):
+        return self.vars.values()
+
+class Edge(View):
+    #
+    # An edge of the network and its attributes:
+    # shortcuts - shortcuts that the edge is a part of
+    # tunnels   - tunnels that the edge is part of
+    # x_e_t     - traffic allocation on e for tunnel t
+    #
+    __slots__ = ()
+
+    @property
+    def e(self):
+        topology = self.network.topology
+        return (topology.node_names[topology.edge_src[self.id]],
+                topology.node_names[topology.edge_dst[self.id]])
+
+    @property
+    def unity(self):
+        return self.network.topology.edge_unity[self.id]
+
+    @unity.setter
+    def unity(self, unity):
+        self.network.topology.edge_unity[self.id] = unity
+
+    @property
+    def capacity(self):
+        return self.network.topology.edge_capacity[self.id]
+
+    @capacity.setter
+    def capacity(self, capacity):
+        self.network.topology.edge_capacity[self.id] = capacity
+
+    @property
+    def distance(self):
+        return self.network.topology.edge_distance[self.id]
+
+    @distance.setter
+    def distance(self, distance):
+        self.network.topology.edge_distance[self.id] = distance
+
+    @property
+    def shortcuts(self):
+        return PathSet(self.network, Shortcut, self.network.topology.edge_shortcuts[self.id])
+
+    @property
+    def tunnels(self):
+        return PathSet(self.network, Tunnel, self.network.topology.edge_tunnels[self.id])
+
+    @property
+    def x_e_t(self):
+        return VarMap(self.network, self.network.edge_vars(self.id))
 
-    def add_tunnel(self, t):
-        assert self.e in [edge.e for edge in t.path]
-        if all(t.pathstr != x.pathstr for x in self.tunnels):
-            self.tunnels.append(t)        
-    
     def increment_capacity(self, capacity_increment):
-        self.capacity += capacity_increment
+        self.network.topology.edge_capacity[self.id] += capacity_increment
 
     def add_distance(self, distance):
-        self.distance = distance
+        self.network.topology.edge_distance[self.id] = distance
 
     def init_x_e_vars(self, model):
-        for idx in range(len(self.tunnels)):
-            tunnel = self.tunnels[idx]
+        x_e_t = self.x_e_t
+        for idx, tunnel in enumerate(self.tunnels):
             var = model.addVar(lb = 0, name = f"x_e_{idx}")
-            self.x_e_t[tunnel] = var
-        return model            
-    
-class Demand:
-    def __init__(self, src, dst, amount):
-        self.src = src
-        self.dst = dst
-        self.amount = amount
-        self.tunnels = []
+            x_e_t[tunnel] = var
+        return model
+
+class Demand(View):
+    __slots__ = ()
+
+    @property
+    def src(self):
+        topology = self.network.topology
+        return topology.node_names[topology.demand_src[self.id]]
+
+    @property
+    def dst(self):
+        topology = self.network.topology
+        return topology.node_names[topology.demand_dst[self.id]]
+
+    @property
+    def amount(self):
+        return self.network.topology.demand_amount[self.id]
+
+    @amount.setter
+    def amount(self, amount):
+        self.network.topology.demand_amount[self.id] = amount
+
+    @property
+    def tunnels(self):
+        return PathSet(self.network, Tunnel, self.network.topology.demand_tunnels(self.id))
 
     def add_tunnel(self, t):
         assert t.pathstr.split(':')[0] == self.src
         assert t.pathstr.split(':')[-1] == self.dst
-        if t.pathstr not in [x.pathstr for x in self.tunnels]:
-            self.tunnels.append(t)        
-        
-class Shortcut:
-    def __init__(self, path, pathstr, unity, distance):
-        self.path = path
-        self.pathstr = pathstr
-        assert unity > 0
-        self.unity = unity
-        self.distance = distance
-        self.src = path[0].e[0]
-        self.src = path[-1].e[1]
-        self.w_s = 0
-        self.y_s = {}
-        # List of tunnels that the shortcut is in
-        self.tunnels = []
-        for e in path:
-            e.add_shortcut(self)
+        topology = self.network.topology
+        if t.id in topology.demand_tunnels(self.id):
+            return
+        if topology.demand_head[self.id] < 0:
+            topology.demand_head[self.id] = t.id
+        else:
+            topology.tunnel_next[topology.demand_tail[self.id]] = t.id
+        topology.demand_tail[self.id] = t.id
+
+class Shortcut(View):
+    __slots__ = ()
+
+    @property
+    def path(self):
+        # path here is a tuple of edges
+        network = self.network
+        return tuple(Edge(network, e) for e in network.topology.shortcut_row(self.id))
+
+    @property
+    def pathstr(self):
+        topology = self.network.topology
+        return topology.path_str(topology.shortcut_row(self.id))
+
+    @property
+    def unity(self):
+        return self.network.topology.shortcut_unity[self.id]
+
+    @property
+    def distance(self):
+        return self.network.topology.shortcut_distance[self.id]
+
+    @property
+    def src(self):
+        topology = self.network.topology
+        return topology.node_names[topology.edge_src[topology.shortcut_edges[
+            topology.shortcut_ptr[self.id]]]]
+
+    @property
+    def dst(self):
+        topology = self.network.topology
+        return topology.node_names[topology.edge_dst[topology.shortcut_edges[
+            topology.shortcut_ptr[self.id + 1] - 1]]]
+
+    @property
+    def w_s(self):
+        return self.network.shortcut_wavelengths(self.id)[self.id]
+
+    @w_s.setter
+    def w_s(self, var):
+        self.network.shortcut_wavelengths(self.id)[self.id] = var
+
+    @property
+    def y_s(self):
+        return VarMap(self.network, self.network.shortcut_vars(self.id))
+
+    @property
+    def tunnels(self):
+        # Tunnels that the shortcut is in
+        return PathSet(self.network, Tunnel, self.network.topology.shortcut_tunnels[self.id])
 
     def name(self):
         return self.pathstr
-    
+
     def add_tunnel(self, t):
         assert self.pathstr in t.pathstr
-        if all(t.pathstr != x.pathstr for x in self.tunnels):
-            self.tunnels.append(t)        
+        tunnels = self.network.topology.shortcut_tunnels[self.id]
+        if t.id not in tunnels:
+            tunnels.append(t.id)
+            self.network.topology.changed()
 
     def init_wavelength_vars(self, model, var=None):
         if not var:
@@ -101,127 +443,458 @@ class Shortcut:
         else:
             self.w_s = var
         return model
-    
+
     def init_y_s_vars(self, model):
-        for idx in range(len(self.tunnels)):
-            tunnel = self.tunnels[idx]
-            self.y_s[tunnel] = model.addVar(lb = 0, name = f"y_{idx}")                 
+        y_s = self.y_s
+        for idx, tunnel in enumerate(self.tunnels):
+            y_s[tunnel] = model.addVar(lb = 0, name = f"y_{idx}")
         return model
 
-class Tunnel:
-    def __init__(self, path, pathstr):
-        # path here is a list of edges
-        self.path = path
-        self.pathstr = pathstr
+class Tunnel(View):
+    __slots__ = ()
+
+    @property
+    def path(self):
+        # path here is a tuple of edges
+        network = self.network
+        return tuple(Edge(network, e) for e in network.topology.tunnel_row(self.id))
+
+    @property
+    def pathstr(self):
+        topology = self.network.topology
+        return topology.path_str(topology.tunnel_row(self.id))
+
+    @property
+    def shortcuts(self):
         # shortcuts that are a part of the tunnel
-        self.shortcuts = []
-        self.v_flow = None    # Solver variable for flow
-        # add this tunnel to all relevant edges
-        for e in path:
-            e.add_tunnel(self)
-        
+        arrays = self.network.csr()
+        return PathSet(self.network, Shortcut,
+                       arrays.tunnel_shortcuts[arrays.tunnel_shortcut_ptr[self.id]:
+                                               arrays.tunnel_shortcut_ptr[self.id + 1]])
+
+    @property
+    def v_flow(self):
+        # Solver variable for flow
+        return self.network.tunnel_flows(self.id)[self.id]
+
+    @v_flow.setter
+    def v_flow(self, var):
+        self.network.tunnel_flows(self.id)[self.id] = var
+
     def name(self):
         return self.pathstr
-    
+
     def init_flow_var(self, model):
         self.v_flow = model.addVar(lb = 0, name = self.name())
         return model
 
     def add_shortcut(self, s):
-        self.shortcuts.append(s)
-    
+        s.add_tunnel(self)
+
+class TopologyArrays:
+    #
+    # CSR-style integer arrays over object ids. Row i of an incidence
+    # is idx[ptr[i]:ptr[i+1]]:
+    # tunnel_edges    - edges along each tunnel path, in path order
+    # shortcut_edges  - edges along each shortcut path, in path order
+    # edge_tunnels    - tunnels on each edge, in edge.tunnels order
+    # edge_shortcuts  - shortcuts on each edge, in edge.shortcuts order
+    # shortcut_tunnels - tunnels each shortcut is in
+    # tunnel_shortcuts - shortcuts in each tunnel, in shortcut id order
+    # The path rows are the topology's own arrays; the others are the
+    # per-object id arrays flattened.
+    #
+    __slots__ = ('tunnel_ptr', 'tunnel_edges', 'shortcut_ptr', 'shortcut_edges',
+                 'edge_tunnel_ptr', 'edge_tunnels', 'edge_shortcut_ptr', 'edge_shortcuts',
+                 'shortcut_tunnel_ptr', 'shortcut_tunnels',
+                 'tunnel_shortcut_ptr', 'tunnel_shortcuts')
+
+    def __init__(self, topology):
+        self.tunnel_ptr, self.tunnel_edges = topology.tunnel_ptr, topology.tunnel_edges
+        self.shortcut_ptr, self.shortcut_edges = topology.shortcut_ptr, topology.shortcut_edges
+        self.edge_tunnel_ptr, self.edge_tunnels = csr_rows(topology.edge_tunnels)
+        self.edge_shortcut_ptr, self.edge_shortcuts = csr_rows(topology.edge_shortcuts)
+        self.shortcut_tunnel_ptr, self.shortcut_tunnels = csr_rows(topology.shortcut_tunnels)
+        # Transpose of shortcut_tunnels by counting
+        ptr = array('i', [0]) * len(topology.tunnel_ptr)
+        for tunnels in topology.shortcut_tunnels:
+            for t in tunnels:
+                ptr[t + 1] += 1
+        for t in range(1, len(ptr)):
+            ptr[t] += ptr[t - 1]
+        idx = array('i', [0]) * ptr[-1]
+        fill = ptr[:-1]
+        for s, tunnels in enumerate(topology.shortcut_tunnels):
+            for t in tunnels:
+                idx[fill[t]] = s
+                fill[t] += 1
+        self.tunnel_shortcut_ptr, self.tunnel_shortcuts = ptr, idx
+
+def csr_rows(rows):
+    ptr = array('i', [0])
+    idx = array('i')
+    for row in rows:
+        idx.extend(row)
+        ptr.append(len(idx))
+    return ptr, idx
+
+class EdgeTable(Mapping):
+    # network.edges: (market, market) -> Edge, in creation order
+    __slots__ = ('network',)
+
+    def __init__(self, network):
+        self.network = network
+
+    def __getitem__(self, key):
+        return Edge(self.network, self.network.topology.edge_index[key])
+
+    def __contains__(self, key):
+        return key in self.network.topology.edge_index
+
+    def __iter__(self):
+        return iter(self.network.topology.edge_index)
+
+    def __len__(self):
+        return len(self.network.topology.edge_index)
+
+    def values(self):
+        return TableValues(self)
+
+    def items(self):
+        return TableItems(self)
+
+    def views(self):
+        network = self.network
+        return (Edge(network, e) for e in range(len(network.topology.edge_index)))
+
+class PathTable(Mapping):
+    # network.tunnels / network.shortcuts: pathstr -> view, in creation order
+    __slots__ = ('network', 'kind')
+
+    def __init__(self, network, kind):
+        self.network = network
+        self.kind = kind
+
+    def index(self):
+        topology = self.network.topology
+        if self.kind is Tunnel:
+            return topology.tunnel_index, topology.tunnel_row, topology.tunnel_ptr
+        return topology.shortcut_index, topology.shortcut_row, topology.shortcut_ptr
+
+    def find(self, pathstr):
+        if not isinstance(pathstr, str):
+            return -1
+        index, row_of, _ = self.index()
+        row = self.network.topology.path_row(pathstr.split(':'))
+        return -1 if not row else index.find(row, row_of)
+
+    def __getitem__(self, pathstr):
+        i = self.find(pathstr)
+        if i < 0:
+            raise KeyError(pathstr)
+        return self.kind(self.network, i)
+
+    def __contains__(self, pathstr):
+        return self.find(pathstr) >= 0
+
+    def __iter__(self):
+        topology = self.network.topology
+        _, row_of, _ = self.index()
+        return (topology.path_str(row_of(i)) for i in range(len(self)))
+
+    def __len__(self):
+        return len(self.index()[2]) - 1
+
+    def values(self):
+        return TableValues(self)
+
+    def items(self):
+        return TableItems(self)
+
+    def views(self):
+        network, kind = self.network, self.kind
+        return (kind(network, i) for i in range(len(self)))
+
+class DemandTable(MutableMapping):
+    # network.demands: (src, dst) -> Demand, in creation order
+    __slots__ = ('network',)
+
+    def __init__(self, network):
+        self.network = network
+
+    def find(self, key):
+        topology = self.network.topology
+        if not isinstance(key, tuple) or len(key) != 2:
+            return -1
+        src, dst = (topology.nodes.get(mkt) for mkt in key)
+        if src is None or dst is None:
+            return -1
+        return topology.demand_index.find((src.id, dst.id), topology.demand_key)
+
+    def __getitem__(self, key):
+        d = self.find(key)
+        if d < 0:
+            raise KeyError(key)
+        return Demand(self.network, d)
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __setitem__(self, key, demand):
+        raise TypeError("demands are added with Network.add_demand")
+
+    def __delitem__(self, key):
+        d = self.find(key)
+        if d < 0:
+            raise KeyError(key)
+        topology = self.network.topology
+        topology.demand_index.remove(d, topology.demand_key)
+        topology.demand_alive[d] = 0
+        topology.num_demands -= 1
+        topology.changed()
+
+    def __iter__(self):
+        return ((d.src, d.dst) for d in self.views())
+
+    def __len__(self):
+        return self.network.topology.num_demands
+
+    def values(self):
+        return TableValues(self)
+
+    def items(self):
+        return TableItems(self)
+
+    def views(self):
+        network = self.network
+        alive = network.topology.demand_alive
+        return (Demand(network, d) for d in range(len(alive)) if alive[d])
+
+class TableValues(ValuesView):
+    def __iter__(self):
+        return self._mapping.views()
+
+class TableItems(ItemsView):
+    def __iter__(self):
+        for key, value in zip(self._mapping, self._mapping.views()):
+            yield key, value
+
 class Network:
-    def __init__(self, name):
+    #
+    # A topology with its own model variables. Variables are kept per
+    # object id: flows (tunnels), wavelengths (shortcuts) and one dict of
+    # tunnel id -> variable per edge (x_e_t) and per shortcut (y_s).
+    #
+    __slots__ = ('name', 'topology', 'graph', 'vertex_index', 'flows', 'wavelengths',
+                 'edge_x', 'shortcut_y')
+
+    def __init__(self, name, topology=None):
         self.name = name
-        self.nodes = {}
-        self.edges = {}
-        self.shortcuts = {}
-        self.tunnels = {}
-        self.demands = {}
+        self.topology = Topology() if topology is None else topology
         self.graph = None
-        
+        # market -> vertex index in graph, set by helper.init_graph
+        self.vertex_index = {}
+        self.flows = []
+        self.wavelengths = []
+        self.edge_x = []
+        self.shortcut_y = []
+
+    def scenario_copy(self, name=None):
+        # A network over the same topology and graph with no variables
+        # yet; the topology must not change while copies are in use.
+        copy = Network(self.name if name is None else name, self.topology)
+        copy.graph = self.graph
+        copy.vertex_index = self.vertex_index
+        return copy
+
+    @property
+    def nodes(self):
+        return self.topology.nodes
+
+    @property
+    def edges(self):
+        return EdgeTable(self)
+
+    @property
+    def tunnels(self):
+        return PathTable(self, Tunnel)
+
+    @property
+    def shortcuts(self):
+        return PathTable(self, Shortcut)
+
+    @property
+    def demands(self):
+        return DemandTable(self)
+
+    def tunnel_flows(self, t):
+        if t >= len(self.flows):
+            self.flows.extend([None] * (len(self.topology.tunnel_ptr) - 1 - len(self.flows)))
+        return self.flows
+
+    def shortcut_wavelengths(self, s):
+        if s >= len(self.wavelengths):
+            self.wavelengths.extend([0] * (len(self.topology.shortcut_ptr) - 1 -
+                                           len(self.wavelengths)))
+        return self.wavelengths
+
+    def edge_vars(self, e):
+        while e >= len(self.edge_x):
+            self.edge_x.append({})
+        return self.edge_x[e]
+
+    def shortcut_vars(self, s):
+        while s >= len(self.shortcut_y):
+            self.shortcut_y.append({})
+        return self.shortcut_y[s]
+
     def add_node(self, mkt, region=None, device=None):
         assert isinstance(mkt, str)
-        if mkt in self.nodes:
-            node = self.nodes[mkt]
+        topology = self.topology
+        if mkt in topology.nodes:
+            node = topology.nodes[mkt]
         else:
             node = Node(mkt)
-            self.nodes[mkt] = node
+            node.id = len(topology.nodes)
+            topology.nodes[mkt] = node
+            topology.node_names.append(mkt)
         node.update(device=device, region=region)
         return node
 
     def add_edge(self, mktA, mktB, unity=None, capacity=None):
         assert isinstance(mktA, str)
         assert isinstance(mktB, str)
-        self.add_node(mktA)
-        self.add_node(mktB)
+        nodeA = self.add_node(mktA)
+        nodeB = self.add_node(mktB)
         if mktA == mktB: return None
-        
-        if (mktA, mktB) in self.edges:
+
+        topology = self.topology
+        if (mktA, mktB) in topology.edge_index:
             edge = self.edges[(mktA, mktB)]
             edge.increment_capacity(capacity)
         else:
-            edge = Edge((mktA, mktB), unity, capacity)
-            self.edges[(mktA, mktB)] = edge
-            
+            edge = Edge(self, len(topology.edge_index))
+            topology.edge_index[(mktA, mktB)] = edge.id
+            topology.edge_src.append(nodeA.id)
+            topology.edge_dst.append(nodeB.id)
+            topology.edge_unity.append(unity)
+            topology.edge_capacity.append(capacity)
+            topology.edge_distance.append(None)
+            topology.edge_tunnels.append(array('i'))
+            topology.edge_shortcuts.append(array('i'))
+            topology.changed()
+
         return edge
 
     def add_demand(self, src, dst, amount, scale=1):
         assert isinstance(src, str)
         assert isinstance(dst, str)
-        self.add_node(src)
-        self.add_node(dst)
-        
-        if (src, dst) not in self.demands:
-            self.demands[(src, dst)] = Demand(src, dst, amount*scale)
+        nodeA = self.add_node(src)
+        nodeB = self.add_node(dst)
 
-        return self.demands[(src, dst)]
+        topology = self.topology
+        d = topology.demand_index.find((nodeA.id, nodeB.id), topology.demand_key)
+        if d < 0:
+            d = len(topology.demand_alive)
+            topology.demand_src.append(nodeA.id)
+            topology.demand_dst.append(nodeB.id)
+            topology.demand_amount.append(amount*scale)
+            topology.demand_alive.append(1)
+            topology.demand_head.append(-1)
+            topology.demand_tail.append(-1)
+            topology.demand_index.add(d, topology.demand_key)
+            topology.num_demands += 1
+            topology.changed()
+
+        return Demand(self, d)
+
+    def add_path(self, hops, ptr, edges, index, row_of):
+        # Append a tunnel or shortcut path; returns its id, or None if
+        # the path exists already
+        for mkt in hops:
+            self.add_node(mkt)
+        row = self.topology.path_row(hops)
+        assert row is not None
+        if index.find(row, row_of) >= 0:
+            return None
+        edges.extend(row)
+        ptr.append(len(edges))
+        path_id = len(ptr) - 2
+        index.add(path_id, row_of)
+        self.topology.changed()
+        return path_id
 
     def add_tunnel(self, tunnel):
         assert isinstance(tunnel, list)
         assert isinstance(tunnel[0], str)
-        tunnel_str = ":".join(tunnel)
-        if tunnel_str in self.tunnels: return
-        
-        tunnel_start = tunnel[0]
-        tunnel_end = tunnel[-1]
-        tunnel_edge_list = []
-        for src, dst in zip(tunnel, tunnel[1:]):
-            nodeA = self.add_node(src)
-            nodeB = self.add_node(dst)
-            assert (src, dst) in self.edges
-            edge = self.edges[(src, dst)]
-            tunnel_edge_list.append(edge)
-
-        tunnel_obj = Tunnel(tunnel_edge_list, tunnel_str)
-        self.tunnels[tunnel_str] = tunnel_obj        
-        if (tunnel_start, tunnel_end) in self.demands:
-            demand = self.demands[(tunnel_start, tunnel_end)]
-            demand.add_tunnel(tunnel_obj)
-        
+        topology = self.topology
+        t = self.add_path(tunnel, topology.tunnel_ptr, topology.tunnel_edges,
+                          topology.tunnel_index, topology.tunnel_row)
+        if t is None: return
+        topology.tunnel_next.append(-1)
+        # add this tunnel to all relevant edges
+        for e in topology.tunnel_row(t):
+            tunnels = topology.edge_tunnels[e]
+            if not tunnels or tunnels[-1] != t:
+                tunnels.append(t)
+
+        # and to the demand between its ends, if there is one
+        key = (topology.nodes[tunnel[0]].id, topology.nodes[tunnel[-1]].id)
+        d = topology.demand_index.find(key, topology.demand_key)
+        if d >= 0:
+            if topology.demand_head[d] < 0:
+                topology.demand_head[d] = t
+            else:
+                topology.tunnel_next[topology.demand_tail[d]] = t
+            topology.demand_tail[d] = t
+
     def add_shortcut(self, shortcut, unity, distance):
         assert isinstance(shortcut, list)
         assert isinstance(shortcut[0], str)
         if unity == 0: return
-        shortcut_str = ":".join(shortcut)
-        if shortcut_str in self.shortcuts:
-            return
-        
-        shortcut_edge_list = []
-        for src, dst in zip(shortcut, shortcut[1:]):
-            nodeA = self.add_node(src)
-            nodeB = self.add_node(dst)
-            assert (src, dst) in self.edges
-            edge = self.edges[(src, dst)]
-            shortcut_edge_list.append(edge)
-
-        shortcut_obj = Shortcut(shortcut_edge_list, shortcut_str, unity, distance)
-        self.shortcuts[shortcut_str] = shortcut_obj
-        
-        for tunnel_str in self.tunnels:
-            if shortcut_str in tunnel_str:
-                tunnel_obj = self.tunnels[tunnel_str]
-                tunnel_obj.add_shortcut(shortcut_obj)
-                shortcut_obj.add_tunnel(tunnel_obj)
-        assert shortcut_obj 
-        return shortcut_obj
+        assert unity > 0
+        topology = self.topology
+        s = self.add_path(shortcut, topology.shortcut_ptr, topology.shortcut_edges,
+                          topology.shortcut_index, topology.shortcut_row)
+        if s is None: return
+        topology.shortcut_unity.append(unity)
+        topology.shortcut_distance.append(distance)
+        topology.shortcut_tunnels.append(array('i'))
+        for e in topology.shortcut_row(s):
+            shortcuts = topology.edge_shortcuts[e]
+            if not shortcuts or shortcuts[-1] != s:
+                shortcuts.append(s)
+
+        tunnels = topology.shortcut_tunnels[s]
+        for tunnel_obj in self.tunnels_with_subpath(shortcut):
+            if not tunnels or tunnels[-1] != tunnel_obj.id:
+                tunnels.append(tunnel_obj.id)
+        return Shortcut(self, s)
+
+    def csr(self):
+        # Integer-array view of the topology, rebuilt after any change.
+        topology = self.topology
+        if topology.derived is None:
+            topology.derived = TopologyArrays(topology)
+        return topology.derived
+
+    def tunnels_with_subpath(self, hops):
+        # Tunnels that traverse hops as a contiguous sub-path, matched
+        # on whole hops (1:2 does not match inside 11:22), once per
+        # occurrence, in tunnel id order.
+        topology = self.topology
+        if len(hops) < 2:
+            return [tunnel for tunnel in self.tunnels.values()
+                    for mkt in tunnel.pathstr.split(':') if hops and mkt == hops[0]]
+        row = topology.path_row(hops)
+        if row is None:
+            return []
+        row = array('i', row)
+        length = len(row)
+        ptr, edges = topology.tunnel_ptr, topology.tunnel_edges
+        tunnels = []
+        for t in topology.edge_tunnels[row[0]]:
+            for i in range(ptr[t], ptr[t + 1] - length + 1):
+                if edges[i] == row[0] and edges[i:i + length] == row:
+                    tunnels.append(Tunnel(self, t))
+        return tunnels
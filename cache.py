@@ -0,0 +1,42 @@
+import hashlib
+import os
+import pickle
+
+#
+# On-disk cache for derived inputs (parsed topologies, scenario sets,
+# tunnel sets, ...). Entries are pickles named <kind>-<key>.pkl, where the
+# key hashes everything the entry was derived from, so a changed input
+# simply misses the cache instead of needing to be invalidated.
+#
+
+CACHE_DIR = ".shoofly_cache"
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fi:
+        for chunk in iter(lambda: fi.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+def cache_path(kind, key):
+    return os.path.join(CACHE_DIR, f"{kind}-{key}.pkl")
+
+def load(kind, key):
+    try:
+        with open(cache_path(kind, key), "rb") as fi:
+            return pickle.load(fi)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def store(kind, key, obj):
+    # Write to a temporary file first so that concurrent readers never
+    # see a partial entry.
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(kind, key)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fo:
+        pickle.dump(obj, fo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
@@ -0,0 +1,92 @@
+from helper import *
+from cpwan_parser import *
+import other_networks_parser
+import failure_engine
+import solver
+import argparse
+import os
+
+#
+# Objective agreement between the solver backends. Every check builds
+# the same model on each backend and compares the optimal objectives;
+# MIP objectives may differ by the relative MIP gap.
+#
+
+MIPGAP = 0.0001
+
+def wavelength_objective(network, shortcut_node_pairs):
+    # The shoofly model without failures
+    model = Model("mip")
+    model.setParam("OutputFlag", 0)
+    model.setParam("mipgap", MIPGAP)
+    initialize_optimization_variables(model, network)
+    model.update()
+    get_constraints(network, shortcut_node_pairs, model)
+    model.setObjective(get_wavelength_objective(network), GRB.MAXIMIZE)
+    model.optimize()
+    assert model.status == GRB.OPTIMAL
+    return model.ObjVal
+
+def max_flow_objective(network, shortcut_node_pairs):
+    # The max-flow LP of the failure evaluation, without failures
+    engine = failure_engine.max_flow_engine(network)
+    status, objective = engine.solve([])
+    assert status == GRB.OPTIMAL
+    return objective
+
+CHECKS = [wavelength_objective, max_flow_objective]
+
+def check(build, backends, tolerance=2 * MIPGAP):
+    # build() returns a fresh (network, shortcut_node_pairs); the model
+    # variables live on the network objects, so every solve gets its own.
+    agree = True
+    for func in CHECKS:
+        objectives = {}
+        for name in backends:
+            solver.use(name)
+            objectives[name] = func(*build())
+        values = list(objectives.values())
+        ok = all(abs(v - values[0]) <= tolerance * max(1.0, abs(values[0])) for v in values)
+        agree &= ok
+        print(func.__name__, objectives, "agree" if ok else "DISAGREE")
+    return agree
+
+def load_teavar_network(name, scale=1.0, nhops=3):
+    # A TeaVaR topology with its demands, tunnels and shortcuts, parsed
+    # the way shoofly.py does
+    network, nxnetwork = other_networks_parser.parse_topology(name)
+    network = other_networks_parser.parse_demands(name, network, scale=scale)
+    network = other_networks_parser.parse_tunnels(network, nxnetwork)
+    shortcut_node_pairs = init_shortcuts(network, nhops=nhops)
+    return network, shortcut_node_pairs
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hops", help="maximum number of shortcut hops", type=int, nargs="+")
+    parser.add_argument("-s", "--scale", help="scale demands by this factor", type=float,
+                        default=1.0)
+    parser.add_argument("-n", "--name", help="network name: cpwan or a TeaVaR topology in "
+                        "teavar-data", type=str, default="cpwan")
+    args = parser.parse_args()
+    print(args)
+
+    if args.name == "cpwan":
+        load = load_network
+    elif os.path.isfile(other_networks_parser.topology_file(args.name)):
+        load = load_teavar_network
+    else:
+        parser.error("network %s does not exist" % args.name)
+
+    def build(nhops):
+        network, shortcut_node_pairs = load(args.name, scale=args.scale, nhops=nhops)
+        remove_demands_without_tunnels(network)
+        return network, shortcut_node_pairs
+
+    agree = True
+    for nhops in args.hops:
+        print("hops:", nhops)
+        agree &= check(lambda: build(nhops), solver.BACKENDS)
+    assert agree, "solver backends disagree"
+
+if __name__ == '__main__':
+    main()
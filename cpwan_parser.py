@@ -3,9 +3,11 @@ from graph_tool.all import *
 import graph_tool as gt
 import graph_tool.draw
 import graph_tool.collection
-from geopy.distance import distance
 from NetworkTopology import *
 from consts import *
+import helper
+import cache
+import distances
 import pdb
 import csv
 
@@ -92,19 +94,15 @@ def init_network(name, scale=1.0):
         node = network.add_node(market)
         node.update(latitude=site_info[market][0], longitude=site_info[market][1])
 
-    for edge_pair in network.edges:
-        edge = network.edges[edge_pair]
-        nodeA = network.nodes[edge_pair[0]]
-        nodeB = network.nodes[edge_pair[1]]
-        edge_length = distance((nodeA.latitude, nodeA.longitude),
-                               (nodeB.latitude, nodeB.longitude)).km
+    # Link lengths and modulation tiers for all edges at once
+    edges = list(network.edges.values())
+    site = {mkt: (node.latitude, node.longitude) for mkt, node in network.nodes.items()}
+    edge_lengths = distances.pair_distances([(site[edge.e[0]], site[edge.e[1]])
+                                             for edge in edges])
+    unities = distances.unity_lookup(edge_lengths, distances.EDGE_UNITY_TIERS)
+    for edge, edge_length, unity in zip(edges, edge_lengths.tolist(), unities.tolist()):
         edge.add_distance(edge_length)
-        if edge_length <= 800:
-            pass
-        elif edge_length <= 2500:
-            edge.unity = 150
-        else:
-            edge.unity = 100
+        edge.unity = unity
 
     parse_tunnels(network, region_to_nodes)
     # Make sure every demand has at least one tunnel
@@ -128,3 +126,64 @@ def parse_tunnels(network, region_to_nodes):
                 tunnel = network.add_tunnel(path_processed)
             except AssertionError:
                 print("Some edges don't exist", path_processed)
+
+# Bump when the cached network layout or the parsing above changes.
+NETWORK_CACHE_VERSION = 2
+
+def load_network(name, scale=1.0, nhops=3, use_cache=True):
+    '''
+    Parsed CPWAN network with its shortcuts for nhops, as
+    (network, shortcut_node_pairs). The parse is cached on disk keyed by
+    the content of the input files, scale and nhops, so later calls skip
+    the CSV parsing and distance computation. Demands without tunnels are
+    not removed and no graph is attached.
+    '''
+    key = cache.cache_key(NETWORK_CACHE_VERSION,
+                          [cache.file_digest(path) for path in
+                           (CPWAN_TM, CPWAN_TOPOLOGY, OPTICAL_SITE_INFO, CPWAN_PATHS)],
+                          scale, nhops)
+    entry = cache.load("network", key) if use_cache else None
+    if entry is not None:
+        return network_from_entry(name, entry)
+
+    network = init_network(name, scale=scale)
+    shortcut_node_pairs = helper.init_shortcuts(network, nhops=nhops)
+    if use_cache:
+        cache.store("network", key, network_entry(network, shortcut_node_pairs))
+    return network, shortcut_node_pairs
+
+def network_entry(network, shortcut_node_pairs):
+    # Plain tuples in creation order, so that rebuilding through the
+    # Network API reproduces the same object order and ids.
+    return {
+        "nodes": [(n.mkt, n.latitude, n.longitude, tuple(n.devices), tuple(n.regions))
+                  for n in network.nodes.values()],
+        "edges": [(e.e[0], e.e[1], e.unity, e.capacity, e.distance)
+                  for e in network.edges.values()],
+        "demands": [(d.src, d.dst, d.amount) for d in network.demands.values()],
+        "tunnels": list(network.tunnels),
+        "shortcuts": [(s.pathstr, s.unity, s.distance) for s in network.shortcuts.values()],
+        "shortcut_node_pairs": [(pair[0], pair[1], s.pathstr)
+                                for pair, s in shortcut_node_pairs.items()],
+    }
+
+def network_from_entry(name, entry):
+    network = Network(name)
+    for mkt, latitude, longitude, devices, regions in entry["nodes"]:
+        node = network.add_node(mkt)
+        node.latitude = latitude
+        node.longitude = longitude
+        node.devices = list(devices)
+        node.regions = list(regions)
+    for mktA, mktB, unity, capacity, distance in entry["edges"]:
+        edge = network.add_edge(mktA, mktB, unity, capacity)
+        edge.add_distance(distance)
+    for src, dst, amount in entry["demands"]:
+        network.add_demand(src, dst, amount)
+    for tunnel_str in entry["tunnels"]:
+        network.add_tunnel(tunnel_str.split(':'))
+    for shortcut_str, unity, distance in entry["shortcuts"]:
+        network.add_shortcut(shortcut_str.split(':'), unity, distance)
+    shortcut_node_pairs = {(mkt1, mkt2): network.shortcuts[shortcut_str]
+                           for mkt1, mkt2, shortcut_str in entry["shortcut_node_pairs"]}
+    return network, shortcut_node_pairs
@@ -0,0 +1,100 @@
+import numpy as np
+from geopy.distance import distance
+import cache
+
+#
+# Geodesic link lengths and the distance-based modulation tiers.
+#
+# Lengths are computed for many site pairs at once with the inverse
+# Vincenty formula on the WGS-84 ellipsoid, vectorized over the pairs. It
+# agrees with geopy.distance.distance (Karney's geodesic) to well under a
+# metre; the rare nearly antipodal pairs on which Vincenty's iteration does
+# not converge are handed to geopy. Results are kept in a persistent
+# site-pair cache, so every pair is computed once across runs.
+#
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# Unity (Gbps per wavelength) by distance: (tier upper bounds in km,
+# unity of each tier). A distance equal to a bound is in the lower tier.
+EDGE_UNITY_TIERS = ([800, 2500], [200, 150, 100])
+SHORTCUT_UNITY_TIERS = ([800, 2500, 5000], [200, 150, 100, 0])
+
+# Bump when the distance computation changes so the cache is rebuilt
+DISTANCE_CACHE_VERSION = 1
+
+def unity_lookup(distances, tiers):
+    # Unity of every distance (array or scalar) by table lookup
+    bounds, unities = tiers
+    return np.asarray(unities)[np.searchsorted(bounds, distances, side='left')]
+
+def vincenty(lat1, lon1, lat2, lon2, iterations=200, tolerance=1e-12):
+    #
+    # Inverse Vincenty over arrays of coordinates in degrees. Returns the
+    # distances in km and a mask of the pairs that converged.
+    #
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float))
+                              for x in (lat1, lon1, lat2, lon2))
+    L = lon2 - lon1
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    for _ in range(iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        coincident = sin_sigma == 0
+        sin_alpha = np.where(coincident, 0.0,
+                             cosU1 * cosU2 * sin_lam / np.where(coincident, 1.0, sin_sigma))
+        cos2_alpha = 1 - sin_alpha ** 2
+        # Equatorial lines have cos2_alpha = 0 and no cos_2sigma_m term
+        cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                cos_sigma - 2 * sinU1 * sinU2 /
+                                np.where(cos2_alpha == 0, 1.0, cos2_alpha))
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        lam_prev = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        converged = np.abs(lam - lam_prev) < tolerance
+        if converged.all():
+            break
+
+    u2 = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+        B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    km = b * A * (sigma - delta_sigma) / 1000
+    return np.where(coincident, 0.0, km), converged | coincident
+
+def site_pair(site1, site2):
+    # Cache key of a pair of (latitude, longitude) sites, in either order
+    return (site1, site2) if site1 <= site2 else (site2, site1)
+
+def pair_distances(pairs, use_cache=True):
+    #
+    # Geodesic distances in km for a list of ((lat, lon), (lat, lon))
+    # site pairs, as an array. Pairs missing from the site-pair cache are
+    # computed in one vectorized pass and added to it.
+    #
+    key = cache.cache_key(DISTANCE_CACHE_VERSION)
+    known = (cache.load("distances", key) or {}) if use_cache else {}
+    missing = sorted({site_pair(*pair) for pair in pairs} - known.keys())
+    if missing:
+        coords = np.array([site1 + site2 for site1, site2 in missing], dtype=float)
+        km, converged = vincenty(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+        for i in np.flatnonzero(~converged):
+            km[i] = distance(*missing[i]).km
+        known.update(zip(missing, km.tolist()))
+        if use_cache:
+            cache.store("distances", key, known)
+    return np.array([known[site_pair(*pair)] for pair in pairs], dtype=float)
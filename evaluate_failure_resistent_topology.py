@@ -1,35 +1,39 @@
 from post_process_results import *
+import failure_engine
+import solver
+import argparse
 
-def parse_tunnels_bypass(bypass_gr, shortcuts, original_network, bypass_network):
-    tunnels = {}
-    for tunnel_str in original_network.tunnels:
-        tunnel = original_network.tunnels[tunnel_str]
-        assert tunnel_str == tunnel.pathstr
-        # a graph object for every tunnel in the original network
-        tunnels[tunnel_str] = nx.Graph()
-        for node in tunnel.pathstr.split(':'):
-            tunnels[tunnel.pathstr].add_node(node)
-            
-        for node1, node2 in zip(tunnel.pathstr.split(':'), tunnel.pathstr.split(':')[1:]):
-            v1 = find_vertex(bypass_gr, bypass_gr.vp.market, node1)[0]
-            v2 = find_vertex(bypass_gr, bypass_gr.vp.market, node2)[0]
-            edge = bypass_gr.edge(v1, v2)
-            if bypass_gr.ep.capacity[edge] > 0:
-                tunnels[tunnel.pathstr].add_edge(node1, node2)
-                
+# Caps on the bypass paths generated per original tunnel
+MAX_BYPASS_PATHS = 32
+MAX_BYPASS_HOPS = None
+
+def parse_tunnels_bypass(bypass_gr, shortcuts, original_network, bypass_network,
+                         max_paths=MAX_BYPASS_PATHS, max_length=MAX_BYPASS_HOPS):
+    # Every original tunnel is expanded into the paths along it that use
+    # its surviving hops and the allocated shortcuts lying on it.
+    chords = {tunnel_str: set() for tunnel_str in original_network.tunnels}
     for shortcut in shortcuts:
         shortcut_alloc = shortcuts[shortcut]
         if shortcut_alloc == 0: continue
-        for tunnel in original_network.tunnels:
-            if shortcut in original_network.tunnels[tunnel].pathstr:
-                tunnel_gr = tunnels[original_network.tunnels[tunnel].pathstr]
-                tunnel_gr.add_edge(shortcut.split(':')[0], shortcut.split(':')[-1])
+        hops = shortcut.split(':')
+        for tunnel in original_network.tunnels_with_subpath(hops):
+            first = tunnel.pathstr.split(':').index(hops[0])
+            chords[tunnel.pathstr].add((first, first + len(hops) - 1))
 
-    for tunnel in tunnels:
-        tunnel_paths = \
-        list(nx.all_simple_paths(tunnels[tunnel], tunnel.split(':')[0], tunnel.split(':')[-1]))
-        for tunnel_p in tunnel_paths:
-            bypass_network.add_tunnel(tunnel_p)
+    for tunnel_str in original_network.tunnels:
+        tunnel = original_network.tunnels[tunnel_str]
+        assert tunnel_str == tunnel.pathstr
+        nodes = tunnel.pathstr.split(':')
+        dead_hops = set()
+        for i, (node1, node2) in enumerate(zip(nodes, nodes[1:])):
+            v1 = market_vertex(bypass_gr, node1)
+            v2 = market_vertex(bypass_gr, node2)
+            edge = bypass_gr.edge(v1, v2)
+            if bypass_gr.ep.capacity[edge] <= 0:
+                dead_hops.add(i)
+        for positions in expand_tunnel(len(nodes), frozenset(dead_hops),
+                                       frozenset(chords[tunnel_str]), max_paths, max_length):
+            bypass_network.add_tunnel([nodes[i] for i in positions])
 
                 
 def init_network_from_graph(gr, shortcuts, original_network, scale):
@@ -45,116 +49,116 @@ def init_network_from_graph(gr, shortcuts, original_network, scale):
     remove_demands_without_tunnels(network)
     return network
 
-def solve_flow_allocations(network, failure_set):
-    env = Env(empty=True)
-    env.setParam('OutputFlag', 0)
-    env.start()
-    model = Model("mip", env=env)
-    initialize_optimization_variables(model, network)
-    model.update()
-    demand_constraints_te(network, model)
-    flow_conservation_constraints(network, model)
-    edge_capacity_constraints(network, model)
-    objective = get_max_flow_objective(network)
-    failure_scenario_flow_constraint(network, failure_set, model)
-    model.setObjective(objective, GRB.MAXIMIZE)
-    model.update()
-    model.setParam("mipgap", 0.001)
-    model.optimize()
-    assert model.status == 2
-    return model.getObjective().getValue()
+def failure_sets(network, num_edge_failures):
+    # Every set of num_edge_failures links; a failure takes down both
+    # directions of a link.
+    return list(itertools.combinations(network_links(network), num_edge_failures))
 
-def solve_failure_model(network, num_edge_failures=1):
+def solve_failure_model(engine, num_edge_failures=1, sampling=None):
+    # Allocated flow under every single or double link failure, solved on
+    # one max-flow engine per network. With sampling (keyword arguments of
+    # failure_engine.sampled_failure_statistics) a stratified sample is
+    # solved until the mean is known to the requested precision.
+    # Returns (mean, median, std, number of solves).
+    sets = failure_sets(engine.network, num_edge_failures)
+    if sampling is not None:
+        mean, median, std, solves, _ = \
+            failure_engine.sampled_failure_statistics(engine, sets, **sampling)
+        return mean, median, std, solves
     allocations = []
-    count = 0
-    if num_edge_failures == 1:
-        for failed_edge_tuple in network.edges:
-            count += 1
-            if count >= 10: break
-            allocation = solve_flow_allocations(network, [failed_edge_tuple])
-            allocations.append(allocation)
-    else:
-        for failed_edge_tuple1, failed_edge_tuple2 in itertools.combinations(network.edges, r=2):
-            count += 1
-            if count >= 10: break
-            allocation = solve_flow_allocations(network, [failed_edge_tuple1, failed_edge_tuple2])
-            allocations.append(allocation)
-    return np.mean(allocations), np.median(allocations), np.std(allocations)
+    for failure_set in sets:
+        status, allocation = engine.solve(failure_set)
+        assert status == GRB.OPTIMAL
+        allocations.append(allocation)
+    print("Evaluated", len(allocations), "failure sets")
+    return np.mean(allocations), np.median(allocations), np.std(allocations), len(allocations)
     
 network_name = "cpwan"
-failure_allocations = [["failure_num", "value", "type", "nhops", "scale", "name"]]
-for nhops in [3,4,5]:
-    original_network, total_capacity, total_lambdas, total_ports, total_regions = \
-                                get_initial_network_state(network_name, nhops)
-    for demand_scale in range(1, 9):
-        _, _, _, _, _, _, _, bypass_enabled_graph, bypass_shortcuts = get_network_savings(
-            original_network, network_name, total_capacity, total_lambdas,
-            total_ports, total_regions, nhops, demand_scale, failure_num=0)
-        bypass_network =\
-                         init_network_from_graph(bypass_enabled_graph, bypass_shortcuts,
-                                                 original_network, demand_scale)
-        
-        # flow_allocation = solve_flow_allocations(bypass_network, [])
-        for failure_num in [1, 2]:
-            print(network_name, nhops, demand_scale, failure_num)
-            try:
-                fraction_lambda_bypassed, fraction_bw_bypassed, fraction_ports_bypassed, \
-                    fraction_regions_bypassed, wavelengths_by_mod, ports_by_mod, bypass_saving,\
-                    failure_proof_graph, failure_allocated_shortcuts = get_network_savings(
-                        original_network, network_name,
-                        total_capacity, total_lambdas,
-                        total_ports, total_regions, nhops, demand_scale,
-                        failure_num=failure_num)
-            except AssertionError:
-                print("file not found")
-                continue
-            failure_bypass_network = init_network_from_graph(failure_proof_graph,
-                                                             failure_allocated_shortcuts,
-                                                             original_network, demand_scale)
 
-            failure_allocation_mean, failure_allocation_median, failure_allocation_std = \
-                                    solve_failure_model(failure_bypass_network,
-                                                        num_edge_failures=failure_num)
-            low = failure_allocation_mean - failure_allocation_std
-            high = failure_allocation_mean + failure_allocation_std
-            failure_allocations.append([failure_num, failure_allocation_mean,
-                                        "mean", nhops, demand_scale,
-                                        "shoofly-kwise-%d" % failure_num])
-            
-            failure_allocations.append([failure_num, failure_allocation_median,
-                                        "median", nhops, demand_scale,
-                                        "shoofly-kwise-%d" % failure_num])
+def append_statistics(failure_allocations, failure_num, statistics, nhops, demand_scale, name):
+    mean, median, std, solves = statistics
+    for value, kind in [(mean, "mean"), (median, "median"),
+                        (mean + std, "high"), (mean - std, "low"), (solves, "solves")]:
+        failure_allocations.append([failure_num, value, kind, nhops, demand_scale, name])
 
-            failure_allocations.append([failure_num, high,
-                                        "high", nhops, demand_scale,
-                                        "shoofly-kwise-%d" % failure_num])
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hops", help="maximum numbers of shortcut hops", type=int, nargs="+",
+                        default=[3, 4, 5])
+    parser.add_argument("--scales", help="demand scales", type=int, nargs="+",
+                        default=list(range(1, 9)))
+    parser.add_argument("--failures", help="numbers of simultaneous link failures", type=int,
+                        nargs="+", default=[1, 2])
+    parser.add_argument("-t", "--threads", help="solver threads", type=int, default=None)
+    parser.add_argument("--solver", help="solver backend (default: gurobi if installed)",
+                        choices=solver.BACKENDS, default=None)
+    parser.add_argument("--sample", help="estimate from a stratified sample of failure sets",
+                        action="store_true")
+    parser.add_argument("--ci-width", help="stop sampling once the confidence interval is "
+                        "narrower than this fraction of the mean", type=float, default=0.01)
+    parser.add_argument("--confidence", help="confidence level of the interval", type=float,
+                        default=0.95)
+    parser.add_argument("--seed", help="sampling seed", type=int, default=0)
+    args = parser.parse_args()
+    print(args)
+    if args.solver:
+        solver.use(args.solver)
+    sampling = None
+    if args.sample:
+        sampling = {"ci_width": args.ci_width, "confidence": args.confidence, "seed": args.seed}
+
+    # One solver environment for every engine
+    env = Env(empty=True)
+    env.setParam('OutputFlag', 0)
+    env.start()
 
-            failure_allocations.append([failure_num, low,
-                                        "low", nhops, demand_scale,
-                                        "shoofly-kwise-%d" % failure_num])
+    failure_allocations = [["failure_num", "value", "type", "nhops", "scale", "name"]]
+    for nhops in args.hops:
+        original_network, total_capacity, total_lambdas, total_ports, total_regions = \
+                                    get_initial_network_state(network_name, nhops)
+        for demand_scale in args.scales:
+            _, _, _, _, _, _, _, bypass_enabled_graph, bypass_shortcuts = get_network_savings(
+                original_network, network_name, total_capacity, total_lambdas,
+                total_ports, total_regions, nhops, demand_scale, failure_num=0)
+            bypass_network =\
+                             init_network_from_graph(bypass_enabled_graph, bypass_shortcuts,
+                                                     original_network, demand_scale)
+            bypass_engine = failure_engine.max_flow_engine(bypass_network, args.threads, env)
 
-            allocation_mean, allocation_median, allocation_std = \
-                                            solve_failure_model(bypass_network,
-                                                                num_edge_failures=failure_num)
-            low = allocation_mean - allocation_std
-            high = allocation_mean + allocation_std
-            failure_allocations.append([failure_num, allocation_mean,
-                                        "mean", nhops, demand_scale,
-                                        "shoofly"])
-            
-            failure_allocations.append([failure_num, allocation_median,
-                                        "median", nhops, demand_scale,
-                                        "shoofly"])
+            for failure_num in args.failures:
+                print(network_name, nhops, demand_scale, failure_num)
+                try:
+                    fraction_lambda_bypassed, fraction_bw_bypassed, fraction_ports_bypassed, \
+                        fraction_regions_bypassed, wavelengths_by_mod, ports_by_mod, bypass_saving,\
+                        failure_proof_graph, failure_allocated_shortcuts = get_network_savings(
+                            original_network, network_name,
+                            total_capacity, total_lambdas,
+                            total_ports, total_regions, nhops, demand_scale,
+                            failure_num=failure_num)
+                except AssertionError:
+                    print("file not found")
+                    continue
+                failure_bypass_network = init_network_from_graph(failure_proof_graph,
+                                                                 failure_allocated_shortcuts,
+                                                                 original_network, demand_scale)
+                failure_engine_kwise = failure_engine.max_flow_engine(failure_bypass_network,
+                                                                      args.threads, env)
 
-            failure_allocations.append([failure_num, high,
-                                        "high", nhops, demand_scale,
-                                        "shoofly"])
+                append_statistics(failure_allocations, failure_num,
+                                  solve_failure_model(failure_engine_kwise,
+                                                      num_edge_failures=failure_num,
+                                                      sampling=sampling),
+                                  nhops, demand_scale, "shoofly-kwise-%d" % failure_num)
+                append_statistics(failure_allocations, failure_num,
+                                  solve_failure_model(bypass_engine,
+                                                      num_edge_failures=failure_num,
+                                                      sampling=sampling),
+                                  nhops, demand_scale, "shoofly")
 
-            failure_allocations.append([failure_num, low,
-                                        "low", nhops, demand_scale,
-                                        "shoofly"])
+    DATADIR = ""
+    with open(DATADIR + "shoofly_allocations.csv", "w") as fi:
+        writer  = csv.writer(fi)
+        writer.writerows(failure_allocations)
 
-DATADIR = ""
-with open(DATADIR + "shoofly_allocations.csv", "w") as fi:
-    writer  = csv.writer(fi)
-    writer.writerows(failure_allocations)
+if __name__ == '__main__':
+    main()
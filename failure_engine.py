@@ -0,0 +1,248 @@
+import itertools
+import math
+import random
+from statistics import NormalDist
+from solver import *
+import helper
+
+#
+# Evaluate many failure sets against a single model.
+#
+# A failure set only changes which tunnels may carry flow, so instead of
+# rebuilding the network and model per failure set the engine zeroes the
+# upper bound of the affected tunnels' flow variables, re-solves, and
+# restores the bounds. For LPs Gurobi keeps the previous basis across
+# bound changes, so every re-solve is warm started.
+#
+
+class FailureEngine:
+    def __init__(self, network, model):
+        self.network = network
+        self.model = model
+        # The flow variables of this model, by tunnel id. A later model
+        # built over the same network replaces tunnel.v_flow.
+        self.flow_vars = {tunnel.id: tunnel.v_flow for tunnel in network.tunnels.values()}
+
+    def solve(self, failed_edge_set):
+        # (status, objective value or None) with failed_edge_set applied
+        flow_vars = [self.flow_vars[tunnel.id]
+                     for tunnel in helper.failed_tunnels(self.network, failed_edge_set)]
+        upper_bounds = [var.UB for var in flow_vars]
+        for var in flow_vars:
+            var.UB = 0
+        self.model.optimize()
+        status = self.model.status
+        objective = self.model.ObjVal if status == GRB.OPTIMAL else None
+        for var, upper_bound in zip(flow_vars, upper_bounds):
+            var.UB = upper_bound
+        # Apply the restored bounds now so the next read sees them
+        self.model.update()
+        return status, objective
+
+class FailurePruner:
+    #
+    # Feasibility is monotone in the failure set: failing more links
+    # never helps. Any superset of an infeasible set is infeasible and any
+    # subset of a feasible set is feasible, so verdicts for many sets
+    # follow from those already solved. Sets are frozensets of links.
+    #
+    def __init__(self):
+        self.infeasible = set()
+        self.feasible = set()   # every subset of a known feasible set
+        self.pruned = 0
+
+    def verdict(self, links):
+        # True/False when implied by a known verdict, otherwise None
+        if links in self.feasible:
+            self.pruned += 1
+            return True
+        for size in range(1, len(links) + 1):
+            for subset in itertools.combinations(links, size):
+                if frozenset(subset) in self.infeasible:
+                    self.pruned += 1
+                    return False
+        return None
+
+    def record(self, links, feasible):
+        if not feasible:
+            self.infeasible.add(links)
+            return
+        for size in range(1, len(links) + 1):
+            for subset in itertools.combinations(links, size):
+                self.feasible.add(frozenset(subset))
+
+def relax_fixed_integers(model):
+    # Integer variables whose bounds pin them to one value are continuous
+    # in all but name; turning them continuous lets a model with no other
+    # integers be solved as an LP. Returns whether the model is now an LP.
+    model.update()
+    for var in model.getVars():
+        if var.VType != GRB.CONTINUOUS and var.LB == var.UB:
+            var.VType = GRB.CONTINUOUS
+    model.update()
+    return not model.IsMIP
+
+def feasibility_engine(network, shortcut_node_pairs, threads=None):
+    #
+    # Engine answering "can the network carry its demands without any
+    # shortcuts under this failure set?". The wavelength variables are
+    # fixed to zero through their bounds, which makes the model a pure LP.
+    #
+    model = Model("feasibility")
+    model.setParam("OutputFlag", 0)
+    if threads:
+        model.setParam("Threads", threads)
+    helper.initialize_optimization_variables(model, network)
+    model.update()
+    helper.get_constraints(network, shortcut_node_pairs, model)
+    for shortcut in network.shortcuts.values():
+        shortcut.w_s.UB = 0
+    is_lp = relax_fixed_integers(model)
+    assert is_lp
+    model.setObjective(helper.get_wavelength_objective(network), GRB.MAXIMIZE)
+    model.update()
+    return FailureEngine(network, model)
+
+def max_flow_engine(network, threads=None, env=None):
+    #
+    # Engine answering "how much traffic can the network carry under this
+    # failure set?": the max-flow LP of the failure evaluation, built once.
+    #
+    model = Model("max_flow", env=env)
+    model.setParam("OutputFlag", 0)
+    if threads:
+        model.setParam("Threads", threads)
+    helper.initialize_optimization_variables(model, network)
+    model.update()
+    helper.demand_constraints_te(network, model)
+    helper.flow_conservation_constraints(network, model)
+    helper.edge_capacity_constraints(network, model)
+    model.setObjective(helper.get_max_flow_objective(network), GRB.MAXIMIZE)
+    model.update()
+    return FailureEngine(network, model)
+
+class StratifiedSample:
+    #
+    # Failure sets split into strata of similar affected-demand volume
+    # (the traffic of demands that lose at least one tunnel), each stratum
+    # in a seeded sampling order. Within a stratum the order cycles over
+    # the failed links, so every prefix spreads its failures across links
+    # instead of clustering on a few of them.
+    #
+    def __init__(self, network, failure_sets, num_strata=4, seed=0):
+        rng = random.Random(seed)
+        demand_of = {}
+        for demand in network.demands.values():
+            for tunnel in demand.tunnels:
+                demand_of[tunnel.id] = demand
+        volumes = []
+        for failed_edge_set in failure_sets:
+            affected = {demand_of[t.id].id: demand_of[t.id].amount
+                        for t in helper.failed_tunnels(network, failed_edge_set)
+                        if t.id in demand_of}
+            volumes.append(sum(affected.values()))
+
+        order = sorted(range(len(failure_sets)), key=lambda i: volumes[i])
+        size = max(1, math.ceil(len(order) / num_strata))
+        self.strata = [self.link_balanced([failure_sets[i] for i in order[start:start + size]],
+                                          rng)
+                       for start in range(0, len(order), size)]
+
+    @staticmethod
+    def link_balanced(failure_sets, rng):
+        # Round-robin over every failed link: each turn takes the next
+        # unsampled set that contains the link, so a set with k links is
+        # reachable from each of them
+        by_link = {}
+        for failed_edge_set in failure_sets:
+            for link in failed_edge_set:
+                by_link.setdefault(link, []).append(failed_edge_set)
+        links = list(by_link)
+        rng.shuffle(links)
+        for link in links:
+            rng.shuffle(by_link[link])
+        position = dict.fromkeys(links, 0)
+        taken, order = set(), []
+        while links:
+            for link in links:
+                sets = by_link[link]
+                i = position[link]
+                while i < len(sets) and sets[i] in taken:
+                    i += 1
+                if i < len(sets):
+                    taken.add(sets[i])
+                    order.append(sets[i])
+                position[link] = i + 1
+            links = [link for link in links if position[link] < len(by_link[link])]
+        return order
+
+def sampled_failure_statistics(engine, failure_sets, ci_width, confidence=0.95, num_strata=4,
+                               seed=0):
+    #
+    # Mean allocated flow over failure_sets, estimated from a stratified
+    # sample. Sampling stops once the confidence interval of the mean is
+    # narrower than ci_width times the mean, or when every set has been
+    # solved. Every stratum gets a pilot of max(5, 5%) of its sets before
+    # the interval is tested, after which strata are sampled in proportion
+    # to their size. A partly sampled stratum whose values all agree is not
+    # taken to have zero variance: by the rule of three up to 3/n of its
+    # sets may still differ, by as much as the range of the allocation
+    # (0 to the total demand).
+    # Returns (mean, median, std, solves, half width of the interval).
+    #
+    assert failure_sets
+    sample = StratifiedSample(engine.network, failure_sets, num_strata, seed)
+    sizes = [len(stratum) for stratum in sample.strata]
+    total = sum(sizes)
+    values = [[] for _ in sample.strata]
+    sums = [0.0] * len(sizes)
+    squares = [0.0] * len(sizes)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    demand = sum(d.amount for d in engine.network.demands.values())
+
+    def draw(h):
+        status, value = engine.solve(sample.strata[h][len(values[h])])
+        assert status == GRB.OPTIMAL
+        values[h].append(value)
+        sums[h] += value
+        squares[h] += value * value
+
+    def estimate():
+        mean = variance = 0.0
+        for h, size in enumerate(sizes):
+            n = len(values[h])
+            weight = size / total
+            mean += weight * sums[h] / n
+            if n < size:
+                if min(values[h]) < max(values[h]):
+                    s2 = max(0.0, (squares[h] - sums[h] * sums[h] / n) / (n - 1))
+                else:
+                    p = min(0.5, 3 / n)
+                    s2 = p * (1 - p) * demand * demand
+                variance += weight * weight * s2 / n * (1 - n / size)
+        return mean, z * math.sqrt(variance)
+
+    for h, size in enumerate(sizes):
+        for _ in range(min(size, max(5, math.ceil(0.05 * size)))):
+            draw(h)
+    while True:
+        mean, half_width = estimate()
+        if 2 * half_width <= ci_width * abs(mean):
+            break
+        remaining = [h for h, size in enumerate(sizes) if len(values[h]) < size]
+        if not remaining:
+            break
+        draw(min(remaining, key=lambda h: len(values[h]) / sizes[h]))
+
+    # Each sampled value stands for size / n failure sets of its stratum
+    weighted = sorted((value, sizes[h] / len(values[h]))
+                      for h in range(len(sizes)) for value in values[h])
+    cumulative = 0.0
+    for median, weight in weighted:
+        cumulative += weight
+        if cumulative >= total / 2:
+            break
+    std = math.sqrt(sum(weight * (value - mean) ** 2 for value, weight in weighted) / total)
+    solves = sum(map(len, values))
+    print(f"Sampled {solves} of {total} failure sets: mean {mean} +/- {half_width}")
+    return mean, median, std, solves, half_width
@@ -1,76 +1,110 @@
 import itertools
 import json
+import math
 from helper import *
 from cpwan_parser import *
+import failure_engine
+import parallel
+import solver
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument("hops", help="maximum number of shortcut hops", type=int)
-parser.add_argument("-s", "--scale", help="scale demands by this factor", type=float, default=1.0)
-args = parser.parse_args()
-print(args)
+# Per-worker state, set up once per process by init_worker
+worker = {}
 
-# This network is simply to enumerate all edges
-network = init_network("cpwan", scale=args.scale)
+def init_worker(scale, hops, threads):
+    # One network and one LP per worker, reused for every failure set
+    network, shortcut_node_pairs = load_network("cpwan", scale=scale, nhops=hops)
+    init_graph(network)
+    remove_demands_without_tunnels(network)
+    worker["engine"] = failure_engine.feasibility_engine(network, shortcut_node_pairs,
+                                                         threads=threads)
 
-possible_srlgs = {1:[], 2:[]}
-for failed_edge_tuple in network.edges:
-    print("Failure", failed_edge_tuple)
-    model = Model("mip")
-    if tuple(reversed(failed_edge_tuple)) in possible_srlgs[1]:
-        # If this tuple has already been tested
-        continue
-    
-    # Initialize a new network for the failure scenario
-    f_network = init_network("cpwan", scale=args.scale)
-    f_network = init_graph(f_network)
-    f_network, shortcut_node_pairs = init_shortcuts(f_network, nhops=args.hops)
-    f_network = remove_demands_without_tunnels(f_network)
+def check_failure(failed_edge_set):
+    status, _ = worker["engine"].solve(failed_edge_set)
+    return status == GRB.OPTIMAL
 
-    # Initialize all variables except wavelength variables on shortcuts
-    model = initialize_optimization_variables(model, f_network)
-    model.update()
-    model = get_constraints(f_network, shortcut_node_pairs, model)
-    model = failure_scenario_flow_constraint(f_network, [failed_edge_tuple], model)
-    for shortcut in f_network.shortcuts.values():
-        model.addConstr(shortcut.w_s <= 0)
-        
-    objective = get_wavelength_objective(f_network)
-    model.setObjective(objective, GRB.MAXIMIZE)
-    model.update()
-    model.setParam("mipgap", 0.001)
-    model.optimize()
-    if model.status == 2: # Optimal solution found
-        possible_srlgs[1].append("%s-%s" % (failed_edge_tuple[0], failed_edge_tuple[1]))
+def failure_key(failed_edge_set):
+    return "|".join("%s-%s" % edge for edge in failed_edge_set)
 
-for failed_edge_tuple1, failed_edge_tuple2 in itertools.combinations(network.edges, r=2):
-    model = Model("mip")
-    print("Failure:", failed_edge_tuple1, failed_edge_tuple2)
-    # Initialize a new network for the failure scenario
-    f_network = init_network("cpwan", scale=args.scale)
-    f_network = init_graph(f_network)
-    f_network, shortcut_node_pairs = init_shortcuts(f_network, nhops=args.hops)
-    f_network = remove_demands_without_tunnels(f_network)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hops", help="maximum number of shortcut hops", type=int)
+    parser.add_argument("-s", "--scale", help="scale demands by this factor", type=float,
+                        default=1.0)
+    parser.add_argument("-w", "--workers", help="number of worker processes", type=int,
+                        default=1)
+    parser.add_argument("-t", "--threads", help="solver threads per worker (default: cores/workers)",
+                        type=int, default=None)
+    parser.add_argument("-c", "--checkpoint", help="checkpoint file, resumed from if present",
+                        type=str, default=None)
+    parser.add_argument("-k", "--max-failures", help="largest number of simultaneous link failures",
+                        type=int, default=2)
+    parser.add_argument("--solver", help="solver backend (default: gurobi if installed)",
+                        choices=solver.BACKENDS, default=None)
+    args = parser.parse_args()
+    print(args)
+    if args.solver:
+        # Workers are spawned with this process's environment and inherit it
+        solver.use(args.solver)
 
-    # Initialize all variables except wavelength variables on shortcuts
-    model = initialize_optimization_variables(model, f_network)
-    model.update()
-    model = get_constraints(f_network, shortcut_node_pairs, model)
-    model = failure_scenario_flow_constraint(f_network, [failed_edge_tuple1, failed_edge_tuple2],
-                                             model)
-    for shortcut in f_network.shortcuts.values():
-        model.addConstr(shortcut.w_s <= 0)
-        
-    objective = get_wavelength_objective(f_network)
-    model.setObjective(objective, GRB.MAXIMIZE)
-    model.update()
-    model.setParam("mipgap", 0.001)
-    model.optimize()
-    if model.status == 2: # Optimal solution found
-        possible_srlgs[2].append("%s-%s|%s-%s" % (failed_edge_tuple1[0], failed_edge_tuple1[1],
-                                                  failed_edge_tuple2[0], failed_edge_tuple2[1]))
+    # This network is simply to enumerate all edges
+    network, _ = load_network("cpwan", scale=args.scale, nhops=args.hops)
 
-DATADIR = ""
-with open(DATADIR + "feasible_link_failures.json", "w") as fi:
-    json.dump(possible_srlgs, fi)
-    
+    # A failure takes down both directions of a link, so (a, b) and (b, a)
+    # are the same failure and every set is checked once, as links.
+    links = network_links(network)
+    canonical = {}
+    for link in links:
+        canonical[link] = link
+        canonical[link[::-1]] = link
+
+    def link_set(key):
+        return frozenset(canonical[tuple(edge_str.split('-'))] for edge_str in key.split('|'))
+
+    checkpoint_file = args.checkpoint or \
+        f"feasible_link_failures_hops_{args.hops}_scale_{args.scale}.checkpoint"
+    checkpoint = parallel.Checkpoint(checkpoint_file)
+    pruner = failure_engine.FailurePruner()
+    for key, feasible in checkpoint.done.items():
+        pruner.record(link_set(key), feasible)
+    print("Links:", len(links), "resumed verdicts:", len(checkpoint))
+
+    threads = parallel.solver_threads(args.workers, args.threads)
+    possible_srlgs = {}
+    solved = 0
+    directed_sets = 0
+    for k in range(1, args.max_failures + 1):
+        directed_sets += math.comb(len(network.edges), k)
+        verdicts = {}
+        pending = []
+        for failed_link_set in itertools.combinations(links, k):
+            verdict = pruner.verdict(frozenset(failed_link_set))
+            if verdict is None:
+                pending.append(failed_link_set)
+            else:
+                verdicts[failed_link_set] = verdict
+        print(f"k={k}: {len(verdicts) + len(pending)} link sets, {len(pending)} to solve")
+
+        for failed_link_set, feasible in parallel.run_tasks(check_failure, pending, args.workers,
+                                                            init_worker,
+                                                            (args.scale, args.hops, threads)):
+            print("Failure:", failed_link_set, "feasible" if feasible else "infeasible")
+            solved += 1
+            checkpoint.record(failure_key(failed_link_set), feasible)
+            pruner.record(frozenset(failed_link_set), feasible)
+            verdicts[failed_link_set] = feasible
+
+        possible_srlgs[k] = [failure_key(failed_link_set)
+                             for failed_link_set in itertools.combinations(links, k)
+                             if verdicts[failed_link_set]]
+
+    print(f"Solved {solved} failure sets; {directed_sets - solved} solves avoided "
+          f"({pruner.pruned} implied by monotonicity or resumed, the rest by treating "
+          f"both directions of a link as one failure)")
+
+    DATADIR = ""
+    with open(DATADIR + "feasible_link_failures.json", "w") as fi:
+        json.dump(possible_srlgs, fi)
+
+if __name__ == '__main__':
+    main()
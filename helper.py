@@ -1,7 +1,10 @@
+import functools
 import random
 import json
 import os
-from gurobipy import *
+import numpy as np
+from solver import *
+import distances
 import pdb
 from graph_tool.all import *
 import graph_tool as gt
@@ -27,38 +30,83 @@ def shortest_path_by_distance(G, v1, v2, nhops):
     return sorted_sps[0][0], sorted_sps[0][1]
 
 def unity_from_distance(shortcut_distance):
-    if shortcut_distance <= 800:
-        unity = 200
-    elif shortcut_distance <= 2500:
-        unity = 150
-    elif shortcut_distance <= 5000:
-        unity = 100
-    else:
-        unity = 0
-    return unity
+    return int(distances.unity_lookup(shortcut_distance, distances.SHORTCUT_UNITY_TIERS))
     
+def shortest_paths_by_distance(adjacency, src, nhops):
+    # Single-source version of shortest_path_by_distance: for every
+    # market reachable from src in a path of at most nhops markets, the
+    # minimum-distance path among its minimum-hop paths, as
+    # market -> (path_str, distance). adjacency[market] lists
+    # (market, distance, edge index) in network.edges order. One layered
+    # BFS replaces an all_shortest_paths enumeration per destination;
+    # distances are summed along the path in the same order, so they are
+    # identical. Ties go the way all_shortest_paths enumerates paths: it
+    # walks predecessors back from the destination in in-edge insertion
+    # order, so on equal distance the predecessor whose edge comes first
+    # in network.edges wins.
+    hops = {src: 0}
+    distance = {src: 0}
+    pred = {src: None}
+    pred_edge = {}
+    frontier = [src]
+    for depth in range(1, nhops):
+        next_frontier = []
+        for u in frontier:
+            for v, edge_distance, edge_index in adjacency[u]:
+                if v in hops and hops[v] < depth: continue
+                v_distance = distance[u] + edge_distance
+                if v not in hops:
+                    hops[v] = depth
+                    next_frontier.append(v)
+                elif v_distance > distance[v] or \
+                     (v_distance == distance[v] and edge_index > pred_edge[v]):
+                    continue
+                distance[v] = v_distance
+                pred[v] = u
+                pred_edge[v] = edge_index
+        frontier = next_frontier
+
+    paths = {}
+    for dst in hops:
+        if dst == src: continue
+        path = [dst]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        paths[dst] = (':'.join(path), distance[dst])
+    return paths
+
 def init_shortcuts(network, nhops=3):
-    G = network.graph
+    adjacency = {mkt: [] for mkt in network.nodes}
+    for edge_index, ((mktA, mktB), edge) in enumerate(network.edges.items()):
+        adjacency[mktA].append((mktB, edge.distance or 0.0, edge_index))
+
     shortcut_node_pairs = {}
-    for vertex_1 in G.vertices():
-        for vertex_2 in G.vertices():
-            if vertex_1 == vertex_2: continue
-            if G.edge(vertex_1, vertex_2) or G.edge(vertex_2, vertex_1): continue
-            if (G.vp.market[vertex_2], G.vp.market[vertex_1]) in shortcut_node_pairs:
-                symmetrical_shortcut = shortcut_node_pairs[(G.vp.market[vertex_2],
-                                                            G.vp.market[vertex_1])]
+    for mkt_1 in network.nodes:
+        candidates = None
+        for mkt_2 in network.nodes:
+            if mkt_1 == mkt_2: continue
+            if (mkt_1, mkt_2) in network.edges or (mkt_2, mkt_1) in network.edges: continue
+            if (mkt_2, mkt_1) in shortcut_node_pairs:
+                symmetrical_shortcut = shortcut_node_pairs[(mkt_2, mkt_1)]
                 shortcut_hop_list = symmetrical_shortcut.pathstr.split(':')
                 shortcut_hop_list.reverse()
                 shortcut_str = ':'.join(shortcut_hop_list)
                 shortcut_distance = symmetrical_shortcut.distance
+                unity = symmetrical_shortcut.unity
             else:
-                shortcut_str, shortcut_distance = shortest_path_by_distance(G, vertex_1,
-                                                                            vertex_2, nhops)
-                if not shortcut_str: continue
-            unity = unity_from_distance(shortcut_distance)
+                if candidates is None:
+                    candidates = shortest_paths_by_distance(adjacency, mkt_1, nhops)
+                    # Unity of every candidate from mkt_1 in one table lookup
+                    candidate_unities = dict(zip(candidates, distances.unity_lookup(
+                        [d for _, d in candidates.values()],
+                        distances.SHORTCUT_UNITY_TIERS).tolist()))
+                if mkt_2 not in candidates: continue
+                shortcut_str, shortcut_distance = candidates[mkt_2]
+                unity = candidate_unities[mkt_2]
             shortcut_obj = network.add_shortcut(shortcut_str.split(':'), unity, shortcut_distance)
             if shortcut_obj:
-                shortcut_node_pairs[(G.vp.market[vertex_1], G.vp.market[vertex_2])] = shortcut_obj
+                shortcut_node_pairs[(mkt_1, mkt_2)] = shortcut_obj
 
     for x in shortcut_node_pairs:
         assert (x[1], x[0]) in shortcut_node_pairs
@@ -67,6 +115,8 @@ def init_shortcuts(network, nhops=3):
 
 
 def init_graph(network):
+    # Failure-scenario copies (Network.scenario_copy) share the graph of
+    # their base network instead of building one.
     G = Graph(directed=True)
     G.vp.lat      = G.new_vertex_property("double")
     G.vp.lon      = G.new_vertex_property("double")
@@ -75,36 +125,32 @@ def init_graph(network):
     G.ep.distance = G.new_edge_property("double")
     G.ep.unity    = G.new_edge_property("int")
     G.ep.shortcut = G.new_edge_property("boolean")
-    
-    for mkt in network.nodes:
-        v = G.add_vertex()
-        G.vp.market[v] = mkt
-        try:
-            G.vp.lat[v] = network.nodes[mkt].latitude
-            G.vp.lon[v] = network.nodes[mkt].latitude
-        except TypeError:
-            pass
-
-    for mktA, mktB in network.edges:
-        v1 = find_vertex(G, G.vp.market, mktA)
-        assert len(v1) == 1
-        v1 = v1[0]
-        v2 = find_vertex(G, G.vp.market, mktB)
-        assert len(v2) == 1
-        v2 = v2[0]
-        if G.edge(v1, v2):
-            e = G.edge(v1,v2)
-        else:
-            e = G.add_edge(v1,v2)
-        try:
-            G.ep.distance[e] = network.edges[(mktA, mktB)].distance
-        except TypeError:
-            pass
-        G.ep.capacity[e] = network.edges[(mktA, mktB)].capacity
-        G.ep.unity[e] = network.edges[(mktA, mktB)].unity
-        G.ep.shortcut[e] = False
-        
+
+    network.vertex_index = {mkt: idx for idx, mkt in enumerate(network.nodes)}
+    G.add_vertex(len(network.nodes))
+    for mkt, idx in network.vertex_index.items():
+        G.vp.market[G.vertex(idx)] = mkt
+    G.vp.lat.a = [node.latitude or 0.0 for node in network.nodes.values()]
+    G.vp.lon.a = [node.longitude or 0.0 for node in network.nodes.values()]
+    G.gp.market_index = G.new_graph_property("object", network.vertex_index)
+
+    # One row per edge: source, target, distance, capacity, unity
+    edge_list = np.array([[network.vertex_index[mktA], network.vertex_index[mktB],
+                           edge.distance or 0.0, edge.capacity, edge.unity]
+                          for (mktA, mktB), edge in network.edges.items()],
+                         dtype=float).reshape(-1, 5)
+    G.add_edge_list(edge_list, eprops=[G.ep.distance, G.ep.capacity, G.ep.unity])
+    G.ep.shortcut.a = False
+
     network.graph = G
+
+def market_vertex(G, mkt):
+    # O(1) market -> vertex lookup. Graphs not built by init_graph get
+    # their index built on first use.
+    if "market_index" not in G.gp:
+        G.gp.market_index = G.new_graph_property(
+            "object", {G.vp.market[v]: int(v) for v in G.vertices()})
+    return G.vertex(G.gp.market_index[mkt])
                 
 def remove_demands_without_tunnels(network):
     removable_demands = [p for p, d in network.demands.items() if not d.tunnels]
@@ -113,6 +159,35 @@ def remove_demands_without_tunnels(network):
         del network.demands[demand_pair]
         
 
+@functools.lru_cache(maxsize=None)
+def expand_tunnel(num_nodes, dead_hops, chords, max_paths=None, max_length=None):
+    #
+    # Paths from the first to the last node of a tunnel with num_nodes
+    # nodes, as tuples of node positions, when the hop i -> i+1 is unusable
+    # for every i in dead_hops and each (i, j) in chords is a shortcut that
+    # jumps forward from position i to j. Paths only move forward, so the
+    # walk is a DP over positions from the end: every suffix from i is a
+    # step to a successor followed by one of its suffixes. Suffixes are
+    # kept shortest first and cut at max_paths and at max_length hops, so
+    # the caps keep the shortest paths. Memoized: the same tunnel under the
+    # same dead hops and active shortcuts is expanded once.
+    #
+    successors = [set() for _ in range(num_nodes)]
+    for i in range(num_nodes - 1):
+        if i not in dead_hops:
+            successors[i].add(i + 1)
+    for i, j in chords:
+        successors[i].add(j)
+
+    suffixes = [None] * num_nodes
+    suffixes[num_nodes - 1] = [(num_nodes - 1,)]
+    for i in range(num_nodes - 2, -1, -1):
+        paths = [(i,) + suffix for j in successors[i] for suffix in suffixes[j]
+                 if max_length is None or len(suffix) <= max_length]
+        paths.sort(key=lambda path: (len(path), path))
+        suffixes[i] = paths[:max_paths]
+    return tuple(suffixes[0])
+
 def initialize_optimization_variables(model, network, main_network=None):
     
     for tunnel in network.tunnels.values():
@@ -147,14 +222,30 @@ def demand_constraints_te(network, model):
         assert len(demand.tunnels) > 0
         model.addConstr(demand.amount >= flow_on_tunnels)
 
+def shortcut_incidence(network):
+    # (edge, tunnel) -> shortcuts on edge that tunnel can ride, in the
+    # same order as edge.shortcuts.
+    incidence = {}
+    for shortcut in network.shortcuts.values():
+        for tunnel in shortcut.tunnels:
+            for edge in shortcut.path:
+                if (edge, tunnel) not in incidence:
+                    incidence[(edge, tunnel)] = []
+                incidence[(edge, tunnel)].append(shortcut)
+    return incidence
+
 def flow_conservation_constraints(network, model):
+    # Walk each tunnel's own path rather than every edge; edges are
+    # visited in network.edges order so constraints come out in the
+    # same order as a tunnel x edge scan would produce them.
+    edge_order = {edge: idx for idx, edge in enumerate(network.edges.values())}
+    incidence = shortcut_incidence(network)
     for tunnel in network.tunnels.values():
-        for edge in network.edges.values():
-            if tunnel in edge.tunnels:
-                x_e_t = edge.x_e_t[tunnel]
-                y_s_t_sum = sum([shortcut.y_s[tunnel] for shortcut in edge.shortcuts
-                                 if tunnel in shortcut.tunnels])
-                model.addConstr(tunnel.v_flow <= x_e_t + y_s_t_sum)
+        for edge in sorted(tunnel.path, key=edge_order.__getitem__):
+            x_e_t = edge.x_e_t[tunnel]
+            y_s_t_sum = sum([shortcut.y_s[tunnel]
+                             for shortcut in incidence.get((edge, tunnel), [])])
+            model.addConstr(tunnel.v_flow <= x_e_t + y_s_t_sum)
 
 def edge_capacity_constraints(network, model):
     for edge_pair in network.edges:
@@ -174,11 +265,39 @@ def complementary_shortcut_constraints(network, model, shortcut_node_pairs):
         shortcut_obj_complementary = shortcut_node_pairs[(shortcut_pair[1], shortcut_pair[0])]
         model.addConstr(shortcut_obj.w_s == shortcut_obj_complementary.w_s)
 
+def failed_edge_keys(failed_edge_set):
+    # Failed links given as (src, dst) tuples or 'src-dst' strings, as
+    # directed edge keys. A failed link takes down both directions.
+    failed = set()
+    for edge in failed_edge_set:
+        if isinstance(edge, str):
+            edge = edge.split('-')
+        edge = tuple(edge)
+        failed.add(edge)
+        failed.add(edge[::-1])
+    return failed
+
+def network_links(network):
+    # Undirected links of network, each once in the orientation it is
+    # first seen in network.edges: (a, b) and (b, a) are the same link.
+    links = {}
+    for edge_key in network.edges:
+        if edge_key[::-1] not in links:
+            links[edge_key] = None
+    return list(links)
+
+def failed_tunnels(network, failed_edge_set):
+    # Tunnels of network that traverse a failed link, in tunnel id order.
+    tunnels = {}
+    for edge_key in failed_edge_keys(failed_edge_set):
+        if edge_key not in network.edges: continue
+        for tunnel in network.edges[edge_key].tunnels:
+            tunnels[tunnel.id] = tunnel
+    return [tunnels[tid] for tid in sorted(tunnels)]
+
 def failure_scenario_flow_constraint(f_network, failed_edge_set, model):
-    for tunnel in f_network.tunnels.values():
-        for edge in tunnel.path:
-            if edge.e in failed_edge_set or reversed(edge.e) in failed_edge_set:
-                model.addConstr(tunnel.v_flow <= 0)
+    for tunnel in failed_tunnels(f_network, failed_edge_set):
+        model.addConstr(tunnel.v_flow <= 0)
 
 def get_constraints(network, shortcut_node_pairs, model):
     # Demand constraints
@@ -240,10 +359,10 @@ def write_shortcut_allocations(network, nhops, scale, network_name, failure_link
 
 
 def close_edges(gr, edge1_str, edge2_str):
-    e1_src = find_vertex(gr, gr.vp.market, edge1_str.split('-')[0])[0]
-    e1_dst = find_vertex(gr, gr.vp.market, edge1_str.split('-')[1])[0]
-    e2_src = find_vertex(gr, gr.vp.market, edge2_str.split('-')[0])[0]
-    e2_dst = find_vertex(gr, gr.vp.market, edge2_str.split('-')[1])[0]
+    e1_src = market_vertex(gr, edge1_str.split('-')[0])
+    e1_dst = market_vertex(gr, edge1_str.split('-')[1])
+    e2_src = market_vertex(gr, edge2_str.split('-')[0])
+    e2_dst = market_vertex(gr, edge2_str.split('-')[1])
     # vertex hops in the shortest path between edge1 and edge2
     # are <=3.
     if len(shortest_path(gr, e1_src, e2_src)[0]) <= 2 or \
@@ -255,7 +374,7 @@ def close_edges(gr, edge1_str, edge2_str):
         return False
 
     
-def get_viable_failures(network, k=1):
+def get_viable_failures(network, k=1, seed=0):
     with open(f"{root_dir}/feasible_link_failures.json") as fi:
         feasible_failures = json.load(fi)
     edge_tuples = []
@@ -272,7 +391,7 @@ def get_viable_failures(network, k=1):
             if tuple(reversed(failed_edge_tuple1)) == failed_edge_tuple2: continue
             if close_edges(network.graph, failed_edge_str1, failed_edge_str2):
                 edge_tuples.append([failed_edge_str1, failed_edge_str2])
-        edge_tuples = random.sample(edge_tuples, 500)
+        edge_tuples = random.Random(seed).sample(edge_tuples, min(500, len(edge_tuples)))
 
     print("Failure scenarios", len(edge_tuples))
     return edge_tuples
@@ -0,0 +1,283 @@
+import numpy as np
+import scipy.sparse as sp
+from solver import *
+
+#
+# Sparse-matrix assembly of the Shoofly model.
+#
+# Builds the same variables and constraints as helper.py's
+# initialize_optimization_variables / get_constraints, but from sparse
+# incidence matrices built once per network, with variables created as
+# MVar blocks and each constraint family added by one addMConstr call.
+#
+
+class Incidence:
+    #
+    # Integer indexing of a network's objects and the incidence matrices
+    # the constraint families are assembled from:
+    # edge_tunnel     - edges x tunnels, one nonzero per x_e_t variable
+    # shortcut_tunnel - shortcuts x tunnels, one nonzero per y_s_t variable
+    # shortcut_edge   - shortcuts x edges
+    # demand_tunnel   - demands x tunnels
+    #
+    def __init__(self, network):
+        self.tunnels = list(network.tunnels.values())
+        self.edges = list(network.edges.values())
+        self.shortcuts = list(network.shortcuts.values())
+        self.demands = list(network.demands.values())
+        self.shortcut_index = {s.pathstr: s.id for s in self.shortcuts}
+        T, E = len(self.tunnels), len(self.edges)
+        S = len(self.shortcuts)
+
+        arrays = network.csr()
+        self.edge_tunnel = csr_from_arrays(arrays.edge_tunnel_ptr, arrays.edge_tunnels, T)
+        self.shortcut_tunnel = csr_from_arrays(arrays.shortcut_tunnel_ptr,
+                                               arrays.shortcut_tunnels, T)
+        self.shortcut_edge = csr_from_arrays(arrays.shortcut_ptr, arrays.shortcut_edges, E)
+        self.demand_tunnel = csr_from_rows([[t.id for t in d.tunnels]
+                                            for d in self.demands], T)
+        self.num_x = self.edge_tunnel.nnz
+        self.num_y = self.shortcut_tunnel.nnz
+
+        self.amount = np.array([d.amount for d in self.demands], dtype=float)
+        self.capacity = np.array([e.capacity for e in self.edges], dtype=float)
+        self.edge_unity = np.array([e.unity for e in self.edges], dtype=float)
+        self.shortcut_unity = np.array([s.unity for s in self.shortcuts], dtype=float)
+
+        # Flow conservation, one row per (edge, tunnel) pair:
+        # v_t - x_e_t - sum of y_s_t over shortcuts s on e <= 0
+        x_pair = {}
+        for e in range(E):
+            for p in range(self.edge_tunnel.indptr[e], self.edge_tunnel.indptr[e + 1]):
+                x_pair[(e, self.edge_tunnel.indices[p])] = p
+        rows, cols = [], []
+        for s in range(S):
+            edges = self.shortcut_edge.indices[self.shortcut_edge.indptr[s]:
+                                               self.shortcut_edge.indptr[s + 1]]
+            for q in range(self.shortcut_tunnel.indptr[s], self.shortcut_tunnel.indptr[s + 1]):
+                t = self.shortcut_tunnel.indices[q]
+                for e in edges:
+                    rows.append(x_pair[(e, t)])
+                    cols.append(q)
+        self.fc_v = sp.csr_matrix((np.ones(self.num_x), self.edge_tunnel.indices,
+                                   np.arange(self.num_x + 1)), shape=(self.num_x, T))
+        self.fc_x = -sp.identity(self.num_x, format="csr")
+        self.fc_y = sp.csr_matrix((-np.ones(len(rows)), (rows, cols)),
+                                  shape=(self.num_x, self.num_y))
+
+        # Edge capacity, one row per edge:
+        # sum of x_e_t + unity_e * sum of w_s over shortcuts s on e <= capacity_e
+        self.cap_x = sp.csr_matrix((np.ones(self.num_x), np.arange(self.num_x),
+                                    self.edge_tunnel.indptr), shape=(E, self.num_x))
+        self.cap_w = sp.diags(self.edge_unity) @ self.shortcut_edge.T.tocsr()
+
+        # Wavelength integrality, one row per shortcut:
+        # sum of y_s_t - unity_s * w_s <= 0
+        self.int_y = sp.csr_matrix((np.ones(self.num_y), np.arange(self.num_y),
+                                    self.shortcut_tunnel.indptr), shape=(S, self.num_y))
+        self.int_w = -sp.diags(self.shortcut_unity, format="csr")
+
+        # Full constraint matrices over the concatenated variable blocks
+        self.fc = sp.hstack([self.fc_v, self.fc_x, self.fc_y], format="csr")
+        self.cap = sp.hstack([self.cap_x, self.cap_w], format="csr")
+        self.int = sp.hstack([self.int_y, self.int_w], format="csr")
+
+def csr_from_arrays(ptr, idx, ncols):
+    ptr = np.asarray(ptr, dtype=np.int64)
+    idx = np.asarray(idx, dtype=np.int64)
+    return sp.csr_matrix((np.ones(len(idx)), idx, ptr), shape=(len(ptr) - 1, ncols))
+
+def csr_from_rows(rows, ncols):
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((c for row in rows for c in row), dtype=np.int64,
+                          count=indptr[-1])
+    return sp.csr_matrix((np.ones(len(indices)), indices, indptr),
+                         shape=(len(rows), ncols))
+
+class FlowVars:
+    #
+    # Variable blocks of one network copy, as lists of Var objects in
+    # Incidence order: v (tunnels), x (edge_tunnel nonzeros),
+    # y (shortcut_tunnel nonzeros), w (shortcuts).
+    #
+    def __init__(self, v, x, y, w):
+        self.v = v
+        self.x = x
+        self.y = y
+        self.w = w
+
+def add_flow_vars(model, inc, w=None, v_ub=None):
+    # Create the per-copy variable blocks; w is shared when given.
+    if v_ub is None:
+        v_ub = GRB.INFINITY
+    v = model.addMVar(len(inc.tunnels), lb=0, ub=v_ub, name="v_flow").tolist()
+    x = model.addMVar(inc.num_x, lb=0, name="x_e_t").tolist()
+    y = model.addMVar(inc.num_y, lb=0, name="y_s_t").tolist()
+    if w is None:
+        w = model.addMVar(len(inc.shortcuts), lb=0, vtype=GRB.INTEGER, name="w_s").tolist()
+    return FlowVars(v, x, y, w)
+
+def initialize_optimization_variables(model, network, inc, main_network=None):
+    # Matrix counterpart of helper.initialize_optimization_variables.
+    # Variables are bound back onto the network objects so that callers
+    # reading tunnel.v_flow, edge.x_e_t, shortcut.y_s or shortcut.w_s
+    # keep working.
+    w = None
+    if main_network is not None:
+        w = [main_network.shortcuts[s.pathstr].w_s for s in inc.shortcuts]
+    fv = add_flow_vars(model, inc, w=w)
+    if main_network is None:
+        model.update()
+        model.setAttr("VarName", fv.w, [s.name() for s in inc.shortcuts])
+
+    for tunnel, var in zip(inc.tunnels, fv.v):
+        tunnel.v_flow = var
+    for e, edge in enumerate(inc.edges):
+        for p in range(inc.edge_tunnel.indptr[e], inc.edge_tunnel.indptr[e + 1]):
+            edge.x_e_t[inc.tunnels[inc.edge_tunnel.indices[p]]] = fv.x[p]
+    for s, shortcut in enumerate(inc.shortcuts):
+        for q in range(inc.shortcut_tunnel.indptr[s], inc.shortcut_tunnel.indptr[s + 1]):
+            shortcut.y_s[inc.tunnels[inc.shortcut_tunnel.indices[q]]] = fv.y[q]
+        shortcut.w_s = fv.w[s]
+    return fv
+
+def demand_constraints(model, inc, fv):
+    assert all(inc.demand_tunnel.getnnz(axis=1) > 0)
+    return model.addMConstr(inc.demand_tunnel, fv.v, '>', inc.amount)
+
+def flow_conservation_constraints(model, inc, fv):
+    return model.addMConstr(inc.fc, fv.v + fv.x + fv.y, '<', np.zeros(inc.num_x))
+
+def edge_capacity_constraints(model, inc, fv):
+    return model.addMConstr(inc.cap, fv.x + fv.w, '<', inc.capacity)
+
+def wavelength_integrality_constraints(model, inc, fv):
+    return model.addMConstr(inc.int, fv.y + fv.w, '<', np.zeros(len(inc.shortcuts)))
+
+def complementary_shortcut_constraints(model, inc, fv, shortcut_node_pairs):
+    rows, cols, vals = [], [], []
+    for row, shortcut_pair in enumerate(shortcut_node_pairs):
+        shortcut_obj = shortcut_node_pairs[shortcut_pair]
+        complementary = shortcut_node_pairs[(shortcut_pair[1], shortcut_pair[0])]
+        rows += [row, row]
+        cols += [inc.shortcut_index[shortcut_obj.pathstr],
+                 inc.shortcut_index[complementary.pathstr]]
+        vals += [1.0, -1.0]
+    A = sp.csr_matrix((vals, (rows, cols)),
+                      shape=(len(shortcut_node_pairs), len(inc.shortcuts)))
+    return model.addMConstr(A, fv.w, '=', np.zeros(len(shortcut_node_pairs)))
+
+def get_constraints(model, inc, fv, shortcut_node_pairs):
+    # Same families, in the same order, as helper.get_constraints.
+    constrs = []
+    constrs += demand_constraints(model, inc, fv).tolist()
+    constrs += flow_conservation_constraints(model, inc, fv).tolist()
+    constrs += edge_capacity_constraints(model, inc, fv).tolist()
+    constrs += wavelength_integrality_constraints(model, inc, fv).tolist()
+    constrs += complementary_shortcut_constraints(model, inc, fv, shortcut_node_pairs).tolist()
+    return constrs
+
+def stamp_failure_scenarios(model, network, failure_sets, inc=None):
+    #
+    # Add one copy of the per-scenario flow variables and constraints
+    # for each failure set to a model that already holds the fully built
+    # base network. Copies share the base network's topology, incidence
+    # matrices and wavelength variables; they only differ in the upper
+    # bound of the flow variables, which is zero for every tunnel that
+    # crosses a failed link. Complementary shortcut constraints only
+    # involve the shared wavelength variables and are not repeated.
+    #
+    import helper
+    if inc is None:
+        inc = Incidence(network)
+    w = [shortcut.w_s for shortcut in inc.shortcuts]
+    scenarios = []
+    for failed_edge_set in failure_sets:
+        v_ub = np.full(len(inc.tunnels), GRB.INFINITY)
+        for tunnel in helper.failed_tunnels(network, failed_edge_set):
+            v_ub[tunnel.id] = 0
+        fv = add_flow_vars(model, inc, w=w, v_ub=v_ub)
+        demand_constraints(model, inc, fv)
+        flow_conservation_constraints(model, inc, fv)
+        edge_capacity_constraints(model, inc, fv)
+        wavelength_integrality_constraints(model, inc, fv)
+        scenarios.append(fv)
+    model.update()
+    return scenarios
+
+def build_model(model, network, shortcut_node_pairs, main_network=None, check=False):
+    # Matrix replacement for helper.initialize_optimization_variables
+    # followed by helper.get_constraints. With check=True the legacy
+    # builder is also run on a scratch model and both constraint sets
+    # are compared row by row.
+    if check:
+        expected = legacy_rows(network, shortcut_node_pairs)
+    inc = Incidence(network)
+    fv = initialize_optimization_variables(model, network, inc, main_network)
+    model.update()
+    constrs = get_constraints(model, inc, fv, shortcut_node_pairs)
+    model.update()
+    if check:
+        actual = canonical_rows(model, constrs, var_keys(inc, fv))
+        assert actual == expected, "matrix model differs from the legacy model"
+        print("Matrix model matches the legacy model:", len(constrs), "constraints")
+    return inc, fv
+
+def var_keys(inc, fv):
+    # Model-independent name of every variable: var index -> key
+    keys = {}
+    for tunnel, var in zip(inc.tunnels, fv.v):
+        keys[var.index] = ('v', tunnel.pathstr)
+    for e, edge in enumerate(inc.edges):
+        for p in range(inc.edge_tunnel.indptr[e], inc.edge_tunnel.indptr[e + 1]):
+            tunnel = inc.tunnels[inc.edge_tunnel.indices[p]]
+            keys[fv.x[p].index] = ('x', edge.e, tunnel.pathstr)
+    for s, shortcut in enumerate(inc.shortcuts):
+        for q in range(inc.shortcut_tunnel.indptr[s], inc.shortcut_tunnel.indptr[s + 1]):
+            tunnel = inc.tunnels[inc.shortcut_tunnel.indices[q]]
+            keys[fv.y[q].index] = ('y', shortcut.pathstr, tunnel.pathstr)
+        keys[fv.w[s].index] = ('w', shortcut.pathstr)
+    return keys
+
+def canonical_rows(model, constrs, keys):
+    # Sorted list of rows as (sense, rhs, terms) with '>' rows negated
+    # into '<' rows and zero coefficients dropped.
+    rows = []
+    for constr in constrs:
+        row = model.getRow(constr)
+        terms = {}
+        for i in range(row.size()):
+            key = keys[row.getVar(i).index]
+            terms[key] = terms.get(key, 0.0) + row.getCoeff(i)
+        sense, rhs = constr.Sense, constr.RHS
+        if sense == '>':
+            sense, rhs = '<', -rhs
+            terms = {key: -coeff for key, coeff in terms.items()}
+        terms = tuple(sorted((key, coeff) for key, coeff in terms.items() if coeff != 0))
+        if sense == '=' and terms and terms[0][1] < 0:
+            rhs = -rhs
+            terms = tuple((key, -coeff) for key, coeff in terms)
+        rows.append((sense, rhs + 0.0, terms))
+    return sorted(rows)
+
+def legacy_rows(network, shortcut_node_pairs):
+    import helper
+    scratch = Model("legacy")
+    scratch.setParam("OutputFlag", 0)
+    helper.initialize_optimization_variables(scratch, network)
+    scratch.update()
+    inc = Incidence(network)
+    fv = FlowVars([t.v_flow for t in inc.tunnels],
+                  [inc.edges[e].x_e_t[inc.tunnels[inc.edge_tunnel.indices[p]]]
+                   for e in range(len(inc.edges))
+                   for p in range(inc.edge_tunnel.indptr[e], inc.edge_tunnel.indptr[e + 1])],
+                  [inc.shortcuts[s].y_s[inc.tunnels[inc.shortcut_tunnel.indices[q]]]
+                   for s in range(len(inc.shortcuts))
+                   for q in range(inc.shortcut_tunnel.indptr[s], inc.shortcut_tunnel.indptr[s + 1])],
+                  [s.w_s for s in inc.shortcuts])
+    helper.get_constraints(network, shortcut_node_pairs, scratch)
+    scratch.update()
+    rows = canonical_rows(scratch, scratch.getConstrs(), var_keys(inc, fv))
+    scratch.dispose()
+    return rows
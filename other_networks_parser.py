@@ -1,16 +1,25 @@
 from helper import *
 from itertools import islice
+import math
 import networkx as nx
 import pdb
 import csv
 from NetworkTopology import *
+import cache
+import parallel
 
 # teavar-data directory can be downloaded from: https://github.com/manyaghobadi/teavar/tree/master/code/data
 
+# Bump when tunnel generation changes so stale cache entries miss
+TUNNEL_CACHE_VERSION = 1
+
+def topology_file(network_name):
+    return "teavar-data/%s/topology.txt" % network_name
+
 def parse_topology(network_name):
     network = Network(network_name)
     nxnetwork = nx.Graph()
-    with open("teavar-data/%s/topology.txt" % network_name) as fi:
+    with open(topology_file(network_name)) as fi:
         reader = csv.reader(fi, delimiter=" ")
         for row_ in reader:
             if row_[0] == 'to_node': continue
@@ -30,38 +39,132 @@ def parse_topology(network_name):
 def k_shortest_paths(G, source, target, k):
     return list(islice(nx.shortest_simple_paths(G, source, target), k))
 
-def parse_demands(network_name, network, scale=1):
+def demand_rows(path, num_pairs, chunk_rows):
+    # Time slots of a demand file as float arrays of chunk_rows x num_pairs
+    chunk = []
+    with open(path) as fi:
+        for line in fi:
+            row = line.split()
+            if not row or row[0] == 'to_node': continue
+            assert len(row) == num_pairs
+            chunk.append(row)
+            if len(chunk) == chunk_rows:
+                yield np.array(chunk, dtype=float)
+                chunk = []
+    if chunk:
+        yield np.array(chunk, dtype=float)
+
+def reduce_demand_matrix(path, num_nodes, stat="max", percentile=95, chunk_rows=256):
+    #
+    # Per-pair reduction over the time slots of a demand file, in pair
+    # order (src-major), read chunk by chunk. max and mean keep one running
+    # row. A percentile keeps, per pair, only the slots on the side of the
+    # percentile that np.percentile interpolates between: with T slots
+    # that is the T - floor(p (T-1) / 100) largest values (or the
+    # ceil(p (T-1) / 100) + 1 smallest for p < 50), so the result is exact.
+    #
+    num_pairs = num_nodes ** 2
+    chunks = demand_rows(path, num_pairs, chunk_rows)
+    if stat == "max":
+        result = np.full(num_pairs, -np.inf)
+        for chunk in chunks:
+            np.maximum(result, chunk.max(axis=0), out=result)
+        return result
+    if stat == "mean":
+        total, count = np.zeros(num_pairs), 0
+        for chunk in chunks:
+            total += chunk.sum(axis=0)
+            count += len(chunk)
+        return total / count
+    assert stat == "percentile", f"unknown demand statistic {stat}"
+
+    with open(path) as fi:
+        num_slots = sum(1 for line in fi if line.split() and line.split()[0] != 'to_node')
+    position = percentile / 100 * (num_slots - 1)
+    lo, hi = math.floor(position), math.ceil(position)
+    top = percentile >= 50
+    keep = num_slots - lo if top else hi + 1
+    buffer = np.empty((0, num_pairs))
+    for chunk in chunks:
+        buffer = np.vstack([buffer, chunk])
+        if len(buffer) > keep:
+            # Keep the keep largest (or smallest) values of every column
+            kth = len(buffer) - keep if top else keep - 1
+            buffer = np.partition(buffer, kth, axis=0)
+            buffer = buffer[kth:] if top else buffer[:keep]
+    buffer = np.sort(buffer, axis=0)
+    offset = num_slots - keep if top else 0
+    low, high = buffer[lo - offset], buffer[hi - offset]
+    return low + (position - lo) * (high - low)
+
+def parse_demands(network_name, network, scale=1, stat="max", percentile=95):
+    # One demand per (src, dst) pair: the max over time slots by default,
+    # or the mean or a percentile.
     num_nodes = len(network.nodes)
-    demand_matrix = {}
-    with open("teavar-data/%s/demand.txt" % network_name) as fi:
-        reader = csv.reader(fi, delimiter=" ")
-        for row_ in reader:
-            if row_[0] == 'to_node': continue
-            row = [float(x) for x in row_ if x]
-            assert len(row) == num_nodes ** 2
-            for idx, dem in enumerate(row):
-                from_node = int(idx/num_nodes) + 1
-                to_node = idx % num_nodes + 1
-                assert str(from_node) in network.nodes
-                assert str(to_node) in network.nodes
-                if from_node not in demand_matrix:
-                    demand_matrix[from_node] = {}
-                if to_node not in demand_matrix[from_node]:
-                    demand_matrix[from_node][to_node] = []
-                demand_matrix[from_node][to_node].append(dem/1000.0)
-        for from_node in demand_matrix:
-            for to_node in demand_matrix[from_node]:
-                max_demand = max(demand_matrix[from_node][to_node])
-                network.add_demand(str(from_node), str(to_node), max_demand, scale)
+    demands = reduce_demand_matrix("teavar-data/%s/demand.txt" % network_name, num_nodes,
+                                   stat, percentile) / 1000.0
+    for idx, dem in enumerate(demands.tolist()):
+        from_node = int(idx/num_nodes) + 1
+        to_node = idx % num_nodes + 1
+        assert str(from_node) in network.nodes
+        assert str(to_node) in network.nodes
+        network.add_demand(str(from_node), str(to_node), dem, scale)
 
     return network
 
-def parse_tunnels(network, nxnetwork):
-    # Parse tunnels
-    for node1 in network.nodes:
-        for node2 in network.nodes:
+# Per-worker graph for tunnel generation, set up by init_tunnel_worker
+tunnel_worker = {}
+
+def init_tunnel_worker(nodes, edges, directed):
+    G = nx.DiGraph() if directed else nx.Graph()
+    G.add_nodes_from(nodes)
+    G.add_edges_from(edges)
+    tunnel_worker["graph"] = G
+
+def source_tunnels(task):
+    # k shortest paths from one source to each of its targets
+    src, targets, k = task
+    G = tunnel_worker["graph"]
+    return [k_shortest_paths(G, src, dst, k) for dst in targets]
+
+def tunnel_paths(nxnetwork, nodes, k, workers=1):
+    #
+    # {(src, dst): k shortest paths} for all ordered pairs of nodes, one
+    # task per source. On an undirected topology only pairs with src
+    # before dst are solved; the paths of (dst, src) are their reverses.
+    #
+    directed = nxnetwork.is_directed()
+    tasks = []
+    for i, src in enumerate(nodes):
+        targets = [dst for j, dst in enumerate(nodes)
+                   if j != i and (directed or j > i)]
+        if targets:
+            tasks.append((src, targets, k))
+    paths = {}
+    for (src, targets, _), results in parallel.run_tasks(source_tunnels, tasks, workers,
+                                                         init_tunnel_worker,
+                                                         (list(nxnetwork.nodes),
+                                                          list(nxnetwork.edges), directed)):
+        for dst, dst_paths in zip(targets, results):
+            paths[(src, dst)] = dst_paths
+            if not directed:
+                paths[(dst, src)] = [list(reversed(path)) for path in dst_paths]
+    return paths
+
+def parse_tunnels(network, nxnetwork, k=5, workers=1, use_cache=True):
+    # Parse tunnels. The generated paths are cached on disk keyed by the
+    # topology file and k.
+    nodes = list(network.nodes)
+    key = cache.cache_key(TUNNEL_CACHE_VERSION, cache.file_digest(topology_file(network.name)),
+                          k, nodes)
+    paths = cache.load("tunnels", key) if use_cache else None
+    if paths is None:
+        paths = tunnel_paths(nxnetwork, nodes, k, workers)
+        if use_cache:
+            cache.store("tunnels", key, paths)
+    for node1 in nodes:
+        for node2 in nodes:
             if node1 == node2: continue
-            paths = k_shortest_paths(nxnetwork, node1, node2, 5)
-            for path in paths:
+            for path in paths[(node1, node2)]:
                 tunnel = network.add_tunnel(path)
     return network
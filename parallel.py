@@ -0,0 +1,80 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#
+# Process-pool helpers for the independent solves in the drivers
+# (failure checks, TeaVaR sweeps, tunnel generation).
+#
+
+def solver_threads(workers, threads=None):
+    # Solver threads per worker: an explicit budget, or an even split of
+    # the machine's cores across the workers.
+    if threads:
+        return threads
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def run_tasks(func, tasks, workers, initializer=None, initargs=()):
+    #
+    # Run func over tasks and yield (task, result) pairs as they finish.
+    # Workers are spawned rather than forked so that no solver environment
+    # or license handle is inherited from the parent process; with a
+    # single worker everything runs inline in this process.
+    #
+    tasks = list(tasks)
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield task, func(task)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=initializer, initargs=initargs) as pool:
+        futures = {pool.submit(func, task): task for task in tasks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+class Checkpoint:
+    #
+    # Append-only JSON-lines record of finished tasks, one
+    # {"key": ..., "value": ...} object per line. Records are flushed to
+    # disk as they are written, so a restarted run can skip every task
+    # that completed before a crash.
+    #
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if not os.path.exists(path):
+            return
+        with open(path) as fi:
+            lines = fi.read().split("\n")
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Empty or torn line from an interrupted write
+                continue
+            self.done[record["key"]] = record["value"]
+        if lines[-1]:
+            # Terminate a torn last line so the next record starts cleanly
+            with open(path, "a") as fo:
+                fo.write("\n")
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __getitem__(self, key):
+        return self.done[key]
+
+    def __len__(self):
+        return len(self.done)
+
+    def record(self, key, value):
+        with open(self.path, "a") as fo:
+            fo.write(json.dumps({"key": key, "value": value}) + "\n")
+            fo.flush()
+            os.fsync(fo.fileno())
+        self.done[key] = value
@@ -4,33 +4,44 @@ import argparse
 
 # TeaVaR data at: https://github.com/manyaghobadi/teavar/tree/master/code/data
 
-parser = argparse.ArgumentParser()
-parser.add_argument("hops", help="maximum number of shortcut hops", type=int)
-parser.add_argument("-n", "--network", help="network name", type=str)
-parser.add_argument("-s", "--scale", help="scale demands by this factor", type=float, default=1.0)
-args = parser.parse_args()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hops", help="maximum number of shortcut hops", type=int)
+    parser.add_argument("-n", "--network", help="network name", type=str)
+    parser.add_argument("-s", "--scale", help="scale demands by this factor", type=float, default=1.0)
+    parser.add_argument("-w", "--workers", help="worker processes for tunnel generation", type=int,
+                        default=1)
+    parser.add_argument("--demand-stat", help="per-pair reduction of the demand time slots",
+                        choices=["max", "mean", "percentile"], default="max")
+    parser.add_argument("--percentile", help="percentile for --demand-stat percentile",
+                        type=float, default=95)
+    args = parser.parse_args()
 
-if not os.path.isfile("teavar-data/%s/topology.txt" % args.network):
-    print("Network %s does not exist" % args.network)
+    if not os.path.isfile("teavar-data/%s/topology.txt" % args.network):
+        print("Network %s does not exist" % args.network)
 
-network, nxnetwork = parse_topology(args.network)
-init_graph(network)
-network = parse_demands(args.network, network, scale=args.scale)
-network = parse_tunnels(network, nxnetwork)
-shortcut_node_pairs = init_shortcuts(network, nhops=args.hops)
-remove_demands_without_tunnels(network)
+    network, nxnetwork = parse_topology(args.network)
+    init_graph(network)
+    network = parse_demands(args.network, network, scale=args.scale, stat=args.demand_stat,
+                            percentile=args.percentile)
+    network = parse_tunnels(network, nxnetwork, workers=args.workers)
+    shortcut_node_pairs = init_shortcuts(network, nhops=args.hops)
+    remove_demands_without_tunnels(network)
 
-model = Model("mip")
-initialize_optimization_variables(model, network)
-model.update()
-get_constraints(network, shortcut_node_pairs, model)
-model.update()
-objective = get_wavelength_objective(network)
-model.setObjective(objective, GRB.MAXIMIZE)
-model.update()
-model.setParam("mipgap", 0.001)
-model.optimize()
-shortcut_allocations = get_shortcut_allocations(model, network)
-print("Number of shortcuts with non-zero capacity", len(shortcut_allocations))
-print("Bypassed capacity:", sum(shortcut_allocations.values()))
-write_shortcut_allocations(network, args.hops, args.scale, args.network)
+    model = Model("mip")
+    initialize_optimization_variables(model, network)
+    model.update()
+    get_constraints(network, shortcut_node_pairs, model)
+    model.update()
+    objective = get_wavelength_objective(network)
+    model.setObjective(objective, GRB.MAXIMIZE)
+    model.update()
+    model.setParam("mipgap", 0.001)
+    model.optimize()
+    shortcut_allocations = get_shortcut_allocations(model, network)
+    print("Number of shortcuts with non-zero capacity", len(shortcut_allocations))
+    print("Bypassed capacity:", sum(shortcut_allocations.values()))
+    write_shortcut_allocations(network, args.hops, args.scale, args.network)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 from helper import *
 from cpwan_parser import *
+import matrix_builder
+import parallel
+import solver
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -9,15 +12,45 @@ parser.add_argument("-f", "--failure", help="number of link failures", type=int,
 parser.add_argument("-m", "--model", help="failure model: kwise or teavar", type=str,
                     default="kwise")
 parser.add_argument("-n", "--name", help="network name", type=str, default="cpwan")
+parser.add_argument("--matrix", help="assemble the model from sparse matrices",
+                    action="store_true")
+parser.add_argument("--check-matrix", help="verify the matrix model against the legacy builder",
+                    action="store_true")
+parser.add_argument("--rebuild-failures",
+                    help="build a network copy per failure scenario instead of stamping",
+                    action="store_true")
+parser.add_argument("--seed", help="random seed: TeaVaR round r uses seed + r, and it picks "
+                    "the sampled double-failure scenarios", type=int, default=0)
+parser.add_argument("-w", "--workers", help="TeaVaR cases solved in parallel", type=int,
+                    default=1)
+parser.add_argument("-t", "--threads", help="solver threads per worker (default: cores/workers)",
+                    type=int, default=None)
+parser.add_argument("--warm", help="solve each TeaVaR round's bounds and betas on one model",
+                    action="store_true")
+parser.add_argument("--solver", help="solver backend (default: gurobi if installed)",
+                    choices=solver.BACKENDS, default=None)
 args = parser.parse_args()
 print(args)
+if args.solver:
+    solver.use(args.solver)
 
 
 def mk_network(model, main_network):
-    network = init_network(args.name, scale=args.scale)
-    init_graph(network)
-    shortcut_node_pairs = init_shortcuts(network, nhops=args.hops)
-    remove_demands_without_tunnels(network)
+    if main_network is None:
+        network, shortcut_node_pairs = load_network(args.name, scale=args.scale, nhops=args.hops)
+        init_graph(network)
+        remove_demands_without_tunnels(network)
+    else:
+        # A failure-scenario network shares the main network's topology
+        # and graph and only gets variables of its own. Every shortcut is
+        # the one of its (src, dst) pair, in the order init_shortcuts
+        # created them.
+        network = main_network.scenario_copy()
+        shortcut_node_pairs = {(s.src, s.dst): s for s in network.shortcuts.values()}
+    if args.matrix or args.check_matrix:
+        matrix_builder.build_model(model, network, shortcut_node_pairs, main_network,
+                                   check=args.check_matrix)
+        return network
     initialize_optimization_variables(model, network, main_network)
     model.update()
     get_constraints(network, shortcut_node_pairs, model)
@@ -36,18 +69,22 @@ def add_failures(model, network):
     if not args.failure:
         return
     elif args.failure == 1:
-        viable_link_failures = get_viable_failures(network, k=1)
+        viable_link_failures = get_viable_failures(network, k=1, seed=args.seed)
     else:
-        viable_link_failures = get_viable_failures(network, k=2)
-    
-    # single link failure scenarios
+        viable_link_failures = get_viable_failures(network, k=2, seed=args.seed)
+
+    if not args.rebuild_failures:
+        print("Stamping", len(viable_link_failures), "failure scenarios")
+        matrix_builder.stamp_failure_scenarios(model, network, viable_link_failures)
+        return
+
     for failed_edge_list in viable_link_failures:
         print("Robust to failure on edge", failed_edge_list)
 
-        # Initialize a new network for the failure scenario
+        # A network copy for the failure scenario
         f_network = mk_network(model, network)
 
-        failure_scenario_flow_constraint(f_network, [failed_edge_list], model)
+        failure_scenario_flow_constraint(f_network, failed_edge_list, model)
 
 def get_allocations(model, network, name):
     shortcut_allocations = get_shortcut_allocations(model, network)
@@ -65,18 +102,26 @@ def solve_k_resilient():
 
 def add_wavelength_bound(model, network, bound):
     objective = get_wavelength_objective(network)
-    model.addConstr(objective >= bound)
+    return model.addConstr(objective >= bound)
 
-def solve_teavar_instance(beta, probs, bound, round):
+# Per-worker state, set up once per process by init_teavar_worker
+worker = {}
+
+def init_teavar_worker(threads):
+    worker["threads"] = threads
+
+def solve_teavar_instance(beta, scenarios, bound, round):
     import teavar
     model = Model("mip")
     network = mk_network(model, None)    
     f_network = mk_network(model, network)    
-    alpha = teavar.teavar(model, f_network, beta, probs)
+    alpha = teavar.teavar(model, f_network, beta, scenarios)
     add_wavelength_bound(model, network, bound)
     model.update()
     model.setParam("mipgap", 0.001)
     model.setParam("timelimit", 600)
+    if worker.get("threads"):
+        model.setParam("Threads", worker["threads"])
     model.optimize()
     name = f"{args.name}-beta{beta}-bound{bound}-round{round}"
     try:
@@ -85,7 +130,51 @@ def solve_teavar_instance(beta, probs, bound, round):
     except AttributeError:
         print("Infeasible model")
         return None, None
+
+def solve_teavar_case(case):
+    bound, beta, r, scenarios = case
+    print("CASE:", bound, beta, r)
+    return solve_teavar_instance(beta, scenarios, bound, r)
     
+def solve_teavar_round(task):
+    #
+    # All bounds and betas of one round on a single model. Only the bound's
+    # right-hand side and the slack objective coefficients change between
+    # cases. Bounds are swept from the highest down, so every incumbent
+    # stays feasible for the next case and is passed on as its MIP start.
+    #
+    import teavar
+    r, scenarios, bounds, betas = task
+    model = Model("mip")
+    network = mk_network(model, None)
+    f_network = mk_network(model, network)
+    alpha, qs = teavar.teavar_model(model, f_network, betas[0], scenarios)
+    bound_constr = add_wavelength_bound(model, network, 0)
+    model.setParam("mipgap", 0.001)
+    model.setParam("timelimit", 600)
+    if worker.get("threads"):
+        model.setParam("Threads", worker["threads"])
+    model.update()
+    variables = model.getVars()
+    start = None
+    results = []
+    for bound in sorted(bounds, reverse=True):
+        for beta in betas:
+            print("CASE:", bound, beta, r)
+            bound_constr.RHS = bound
+            teavar.set_beta(qs, beta)
+            if start is not None:
+                model.setAttr("Start", variables, start)
+            model.optimize()
+            if model.SolCount == 0:
+                print("Infeasible model")
+                results.append((bound, beta, None, None))
+                continue
+            print("VAR:", alpha.X, model.ObjVal)
+            results.append((bound, beta, alpha.X, model.ObjVal))
+            start = model.getAttr("X", variables)
+    return results
+
 def init_teavar():
     model = Model("mip")
     network = mk_network(model, None)
@@ -98,22 +187,43 @@ def solve_teavar_scenarios(betas, rounds):
     max_bound, network = init_teavar()
     num_bounds = 5
     cutoff = 0.00001
-    results = [["beta", "round", "alpha", "cvar", "ports_saved", "hops", "max_saving"]]
-    for i in range(num_bounds + 1):
-        bound = max_bound * (i / num_bounds)
-        # if i < num_bounds:continue
-        for beta in betas:
-            for r in range(rounds):
-                print("CASE:", bound, beta, r)
-                scenario_probs = teavar.init_scenarios(network, cutoff)
-                alpha, cvar = solve_teavar_instance(beta, scenario_probs, bound, r)
-                results.append([beta, r, alpha, cvar, int(bound), args.hops, int(max_bound)])
-
-        path = f"{root_dir}/cpwan/"
-        fname = f"{path}/teavar_{args.hops}_{args.scale}.csv"
-        with open(fname, "a") as fi:
-            writer = csv.writer(fi)
-            writer.writerows(results)
+    # One scenario set per round, shared by every bound and beta
+    seeds = [args.seed + r for r in range(rounds)]
+    round_scenarios = [teavar.init_scenarios(network, cutoff, seed) for seed in seeds]
+    cases = [(max_bound * (i / num_bounds), beta, r, round_scenarios[r])
+             for i in range(num_bounds + 1)
+             for beta in betas
+             for r in range(rounds)]
+
+    # Rows are written as cases finish, in completion order
+    path = f"{root_dir}/cpwan/"
+    fname = f"{path}/teavar_{args.hops}_{args.scale}.csv"
+    new_file = not os.path.exists(fname) or os.path.getsize(fname) == 0
+    threads = parallel.solver_threads(args.workers, args.threads)
+    with open(fname, "a") as fi:
+        writer = csv.writer(fi)
+        if new_file:
+            writer.writerow(["beta", "round", "seed", "alpha", "cvar", "ports_saved", "hops",
+                             "max_saving"])
+        if args.warm:
+            bounds = [max_bound * (i / num_bounds) for i in range(num_bounds + 1)]
+            tasks = [(r, round_scenarios[r], bounds, betas) for r in range(rounds)]
+            for (r, _, _, _), round_results in parallel.run_tasks(solve_teavar_round, tasks,
+                                                                  args.workers,
+                                                                  init_teavar_worker,
+                                                                  (threads,)):
+                for bound, beta, alpha, cvar in round_results:
+                    writer.writerow([beta, r, seeds[r], alpha, cvar, int(bound), args.hops,
+                                     int(max_bound)])
+                fi.flush()
+            return
+        for (bound, beta, r, _), (alpha, cvar) in parallel.run_tasks(solve_teavar_case, cases,
+                                                                      args.workers,
+                                                                      init_teavar_worker,
+                                                                      (threads,)):
+            writer.writerow([beta, r, seeds[r], alpha, cvar, int(bound), args.hops,
+                             int(max_bound)])
+            fi.flush()
 
 def solve_teavar():
     betas = [0.9, 0.99]
@@ -0,0 +1,409 @@
+import math
+import os
+import numpy as np
+from scipy import sparse
+
+try:
+    import gurobipy
+except ImportError:
+    gurobipy = None
+
+#
+# Solver layer under the model builders and drivers. Modules import
+# Model, GRB and quicksum from here instead of from gurobipy, and the
+# backend is picked per process:
+#
+# - gurobi: Model is a plain gurobipy.Model.
+# - highs:  Model is HighsModel, a small gurobipy-compatible model solved
+#           with HiGHS through scipy.optimize.milp. It needs no license,
+#           so sweeps can use every core.
+#
+# The backend is "gurobi" when gurobipy is installed and "highs"
+# otherwise; use() or the SHOOFLY_SOLVER environment variable overrides
+# it. use() sets the environment variable, so spawned workers inherit the
+# choice.
+#
+# HighsModel implements the part of the gurobipy API that this repository
+# uses: addVar/addMVar, addConstr/addMConstr, linear expressions, the
+# LB/UB/VType/Obj/X/RHS attributes, and setObjective/optimize. MIP starts
+# are accepted but ignored, and so is the Threads parameter.
+#
+
+__all__ = ["GRB", "Model", "Env", "quicksum", "LinExpr", "Var", "Constr"]
+
+BACKENDS = ("gurobi", "highs")
+
+class GRB:
+    # The gurobipy constants used in this repository, with gurobipy's values
+    LOADED = 1
+    OPTIMAL = 2
+    INFEASIBLE = 3
+    INF_OR_UNBD = 4
+    UNBOUNDED = 5
+    TIME_LIMIT = 9
+    NUMERIC = 12
+    MINIMIZE = 1
+    MAXIMIZE = -1
+    INFINITY = 1e100
+    CONTINUOUS = 'C'
+    BINARY = 'B'
+    INTEGER = 'I'
+    LESS_EQUAL = '<'
+    GREATER_EQUAL = '>'
+    EQUAL = '='
+
+def backend():
+    name = os.environ.get("SHOOFLY_SOLVER") or ("gurobi" if gurobipy else "highs")
+    assert name in BACKENDS, f"unknown solver {name}"
+    return name
+
+def use(name):
+    # Select the backend for this process and the workers it spawns
+    assert name in BACKENDS, f"unknown solver {name}"
+    assert name != "gurobi" or gurobipy is not None, "gurobipy is not installed"
+    os.environ["SHOOFLY_SOLVER"] = name
+
+def Model(name="", env=None):
+    if backend() == "gurobi":
+        return gurobipy.Model(name, env=env)
+    return HighsModel(name)
+
+def Env(empty=False):
+    if backend() == "gurobi":
+        return gurobipy.Env(empty=empty)
+    return HighsEnv()
+
+def quicksum(terms):
+    if backend() == "gurobi":
+        return gurobipy.quicksum(terms)
+    expr = LinExpr()
+    for term in terms:
+        expr.add(term)
+    return expr
+
+class HighsEnv:
+    # Stand-in for gurobipy.Env; HiGHS needs no environment
+    def setParam(self, name, value):
+        pass
+
+    def start(self):
+        return self
+
+class LinExpr:
+    # Linear expression: coeffs maps Var -> coefficient
+    __slots__ = ('coeffs', 'constant')
+    # Make numpy scalars defer to our operators
+    __array_ufunc__ = None
+
+    def __init__(self, coeffs=None, constant=0.0):
+        self.coeffs = {} if coeffs is None else coeffs
+        self.constant = constant
+
+    def add(self, term, mult=1.0):
+        # In-place self += mult * term
+        if isinstance(term, LinExpr):
+            for var, coeff in term.coeffs.items():
+                self.coeffs[var] = self.coeffs.get(var, 0.0) + mult * coeff
+            self.constant += mult * term.constant
+        elif isinstance(term, Var):
+            self.coeffs[term] = self.coeffs.get(term, 0.0) + mult
+        else:
+            self.constant += mult * term
+        return self
+
+    def copy(self):
+        return LinExpr(dict(self.coeffs), self.constant)
+
+    def size(self):
+        return len(self.coeffs)
+
+    def getVar(self, i):
+        return list(self.coeffs)[i]
+
+    def getCoeff(self, i):
+        return list(self.coeffs.values())[i]
+
+    def getValue(self):
+        return self.constant + sum(coeff * var.X for var, coeff in self.coeffs.items())
+
+    def __add__(self, other):
+        return self.copy().add(other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self.copy().add(other, -1.0)
+
+    def __rsub__(self, other):
+        return (self * -1.0).add(other)
+
+    def __mul__(self, other):
+        assert not isinstance(other, (LinExpr, Var)), "expressions must stay linear"
+        return LinExpr({var: coeff * other for var, coeff in self.coeffs.items()},
+                       self.constant * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return self * (1.0 / other)
+
+    def __neg__(self):
+        return self * -1.0
+
+    def __le__(self, other):
+        return TempConstr(self - other, GRB.LESS_EQUAL)
+
+    def __ge__(self, other):
+        return TempConstr(self - other, GRB.GREATER_EQUAL)
+
+    def __eq__(self, other):
+        return TempConstr(self - other, GRB.EQUAL)
+
+    __hash__ = object.__hash__
+
+class Var:
+    __slots__ = ('model', 'index', 'LB', 'UB', 'VType', 'Obj', 'Start', 'VarName')
+    __array_ufunc__ = None
+
+    def __init__(self, model, index, lb, ub, obj, vtype, name):
+        self.model = model
+        self.index = index
+        self.LB = lb
+        self.UB = ub
+        self.VType = vtype
+        self.Obj = obj
+        self.Start = None
+        self.VarName = name
+
+    @property
+    def X(self):
+        if self.model._x is None:
+            raise AttributeError("Unable to retrieve attribute 'X'")
+        return float(self.model._x[self.index])
+
+    x = X
+
+    def _expr(self):
+        return LinExpr({self: 1.0})
+
+    def __add__(self, other):
+        return self._expr().add(other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._expr().add(other, -1.0)
+
+    def __rsub__(self, other):
+        return LinExpr({self: -1.0}).add(other)
+
+    def __mul__(self, other):
+        return self._expr() * other
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return LinExpr({self: -1.0})
+
+    def __le__(self, other):
+        return self._expr() <= other
+
+    def __ge__(self, other):
+        return self._expr() >= other
+
+    def __eq__(self, other):
+        return self._expr() == other
+
+    __hash__ = object.__hash__
+
+class TempConstr:
+    # expr <sense> 0, as produced by comparing expressions
+    __slots__ = ('expr', 'sense')
+
+    def __init__(self, expr, sense):
+        self.expr = expr
+        self.sense = sense
+
+class Constr:
+    __slots__ = ('index', 'vars', 'vals', 'Sense', 'RHS', 'ConstrName')
+
+    def __init__(self, index, vars, vals, sense, rhs, name):
+        self.index = index
+        self.vars = vars
+        self.vals = vals
+        self.Sense = sense
+        self.RHS = rhs
+        self.ConstrName = name
+
+class Block(list):
+    # List of variables or constraints returned by the matrix calls;
+    # tolist() mirrors gurobipy's MVar/MConstr
+    def tolist(self):
+        return list(self)
+
+def _array(value, n):
+    return np.broadcast_to(np.asarray(value, dtype=float), (n,))
+
+class HighsModel:
+    def __init__(self, name=""):
+        self.ModelName = name
+        self.vars = []
+        self.constrs = []
+        self.ModelSense = GRB.MINIMIZE
+        self.ObjCon = 0.0
+        self.params = {"outputflag": 1, "mipgap": 1e-4, "timelimit": math.inf}
+        self.Status = GRB.LOADED
+        self._x = None
+        self._objval = None
+
+    @property
+    def status(self):
+        return self.Status
+
+    @property
+    def ObjVal(self):
+        if self._x is None:
+            raise AttributeError("Unable to retrieve attribute 'ObjVal'")
+        return self._objval
+
+    @property
+    def SolCount(self):
+        return 0 if self._x is None else 1
+
+    @property
+    def IsMIP(self):
+        return any(var.VType != GRB.CONTINUOUS for var in self.vars)
+
+    @property
+    def NumVars(self):
+        return len(self.vars)
+
+    @property
+    def NumConstrs(self):
+        return len(self.constrs)
+
+    @property
+    def NumNZs(self):
+        return sum(len(constr.vars) for constr in self.constrs)
+
+    def setParam(self, name, value):
+        self.params[name.lower()] = value
+
+    def update(self):
+        # Changes apply immediately; kept for gurobipy compatibility
+        pass
+
+    def dispose(self):
+        self.vars, self.constrs = [], []
+
+    def addVar(self, lb=0.0, ub=GRB.INFINITY, obj=0.0, vtype=GRB.CONTINUOUS, name=""):
+        var = Var(self, len(self.vars), lb, ub, obj, vtype, name)
+        self.vars.append(var)
+        return var
+
+    def addMVar(self, shape, lb=0.0, ub=GRB.INFINITY, obj=0.0, vtype=GRB.CONTINUOUS, name=""):
+        lbs, ubs, objs = _array(lb, shape), _array(ub, shape), _array(obj, shape)
+        return Block(self.addVar(float(lbs[i]), float(ubs[i]), float(objs[i]), vtype,
+                                 f"{name}[{i}]")
+                     for i in range(shape))
+
+    def _add_row(self, vars, vals, sense, rhs, name):
+        constr = Constr(len(self.constrs), vars, vals, sense, rhs, name)
+        self.constrs.append(constr)
+        return constr
+
+    def addConstr(self, constr, name=""):
+        expr = constr.expr
+        return self._add_row([var.index for var in expr.coeffs], list(expr.coeffs.values()),
+                             constr.sense, -expr.constant, name)
+
+    def addMConstr(self, A, x, sense, b, name=""):
+        # Rows A x <sense> b over the variable list x
+        A = sparse.csr_matrix(A)
+        columns = np.array([var.index for var in x], dtype=int)
+        senses = [sense] * A.shape[0] if isinstance(sense, str) else list(sense)
+        b = _array(b, A.shape[0])
+        return Block(self._add_row(columns[A.indices[A.indptr[i]:A.indptr[i + 1]]].tolist(),
+                                   A.data[A.indptr[i]:A.indptr[i + 1]].tolist(),
+                                   senses[i], float(b[i]), name)
+                     for i in range(A.shape[0]))
+
+    def getVars(self):
+        return list(self.vars)
+
+    def getConstrs(self):
+        return list(self.constrs)
+
+    def getRow(self, constr):
+        return LinExpr({self.vars[i]: val for i, val in zip(constr.vars, constr.vals)})
+
+    def getAttr(self, name, objs):
+        return [getattr(obj, name) for obj in objs]
+
+    def setAttr(self, name, objs, values):
+        for obj, value in zip(objs, values):
+            setattr(obj, name, value)
+
+    def setObjective(self, expr, sense=None):
+        # As in gurobipy the objective lives in the variables' Obj attribute
+        if isinstance(expr, Var):
+            expr = expr._expr()
+        elif not isinstance(expr, LinExpr):
+            expr = LinExpr(constant=expr)
+        for var in self.vars:
+            var.Obj = 0.0
+        for var, coeff in expr.coeffs.items():
+            var.Obj = coeff
+        self.ObjCon = expr.constant
+        if sense is not None:
+            self.ModelSense = sense
+
+    def getObjective(self):
+        return LinExpr({var: var.Obj for var in self.vars if var.Obj}, self.ObjCon)
+
+    def optimize(self):
+        from scipy.optimize import milp, Bounds, LinearConstraint
+        self._x = self._objval = None
+        n = len(self.vars)
+
+        def finite(values):
+            values = np.array(values, dtype=float)
+            values[values >= GRB.INFINITY] = np.inf
+            values[values <= -GRB.INFINITY] = -np.inf
+            return values
+
+        obj = np.array([var.Obj for var in self.vars], dtype=float)
+        lb = finite([var.LB for var in self.vars])
+        ub = finite([var.UB for var in self.vars])
+        integrality = np.array([var.VType != GRB.CONTINUOUS for var in self.vars], dtype=int)
+        binary = np.array([var.VType == GRB.BINARY for var in self.vars], dtype=bool)
+        lb[binary] = np.maximum(lb[binary], 0)
+        ub[binary] = np.minimum(ub[binary], 1)
+
+        constraints = []
+        if self.constrs:
+            indptr = np.cumsum([0] + [len(constr.vars) for constr in self.constrs])
+            indices = np.fromiter((i for constr in self.constrs for i in constr.vars),
+                                  dtype=int, count=indptr[-1])
+            data = np.fromiter((v for constr in self.constrs for v in constr.vals),
+                               dtype=float, count=indptr[-1])
+            A = sparse.csr_matrix((data, indices, indptr), shape=(len(self.constrs), n))
+            rhs = finite([constr.RHS for constr in self.constrs])
+            senses = np.array([constr.Sense for constr in self.constrs])
+            lower = np.where(senses == GRB.LESS_EQUAL, -np.inf, rhs)
+            upper = np.where(senses == GRB.GREATER_EQUAL, np.inf, rhs)
+            constraints.append(LinearConstraint(A, lower, upper))
+
+        options = {"disp": bool(self.params["outputflag"]),
+                   "mip_rel_gap": self.params["mipgap"]}
+        if math.isfinite(self.params["timelimit"]):
+            options["time_limit"] = self.params["timelimit"]
+        sign = -1.0 if self.ModelSense == GRB.MAXIMIZE else 1.0
+        result = milp(sign * obj, constraints=constraints, integrality=integrality,
+                      bounds=Bounds(lb, ub), options=options)
+
+        self.Status = {0: GRB.OPTIMAL, 1: GRB.TIME_LIMIT, 2: GRB.INFEASIBLE,
+                       3: GRB.UNBOUNDED}.get(result.status, GRB.NUMERIC)
+        if result.x is not None:
+            self._x = result.x
+            self._objval = float(obj @ result.x) + self.ObjCon
@@ -1,4 +1,7 @@
+import math
 import numpy as np
+from scipy import sparse
+import cache
 
 def ones(n):
     return [1 for i in range(n)]
@@ -41,95 +44,257 @@ def subscenarios_rec(distribution, cutoff, remaining, offset = 0, partial = [],
                          partial + [n], scenario_probs)
     return scenario_probs
 
-def subscenarios(distribution, cutoff, first=True, last=True):
-    scenario_probs = subscenarios_rec(distribution, cutoff, len(distribution))
+#
+# Iterative version of subscenarios_rec. Failure sets are int bitsets
+# (bit i set = link i failed) and each node of the search carries the
+# product of its first offset factors, so a node costs O(links) instead
+# of rebuilding bitmap/probs lists and re-multiplying every prefix.
+# Products are accumulated in linear space in the same factor order as
+# prod() above, so probabilities and cutoff decisions are bit-identical
+# to the recursive port (log-space sums would differ in the last ulp).
+#
+def enumerate_scenarios(distribution, cutoff):
+    assert all(0 <= p and p <= 1 for p in distribution)
+    n = len(distribution)
+    up = [1 - p for p in distribution]
+    masks = []
+    probs = []
+    # (failed bitset, first index that may still fail, prefix product)
+    stack = [(0, 0, 1.0)]
+    while stack:
+        mask, offset, prefix = stack.pop()
+        prob = math.prod(up[offset:], start=prefix)
+        if mask == 0 or prob >= cutoff:
+            masks.append(mask)
+            probs.append(prob)
+        children = []
+        prefix_prob = prefix
+        for index in range(offset, n):
+            if prefix_prob < cutoff:
+                break
+            children.append((mask | 1 << index, index + 1, prefix_prob * distribution[index]))
+            prefix_prob *= up[index]
+        # Depth first, lowest index first, like the recursion
+        stack.extend(reversed(children))
+    return masks, probs
+
+def failure_matrix(masks, n):
+    # Bitsets as a boolean (scenarios x links) matrix, True = failed
+    nbytes = (n + 7) // 8
+    packed = np.frombuffer(b"".join(mask.to_bytes(nbytes, "little") for mask in masks),
+                           dtype=np.uint8).reshape(len(masks), nbytes)
+    return np.unpackbits(packed, axis=1, count=n, bitorder="little").astype(bool)
+
+def subscenario_matrix(distribution, cutoff, first=True, last=True):
+    # subscenarios as a boolean (scenarios x links) failure matrix
+    # (True = link down) and an array of probabilities
+    n = len(distribution)
+    masks, probs = enumerate_scenarios(distribution, cutoff)
+    failed = failure_matrix(masks, n)
     if not first:
-        scenario_probs = scenario_probs[1:]
-    sum_prob = sum(sp[1] for sp in scenario_probs)
+        failed, probs = failed[1:], probs[1:]
+    sum_prob = sum(probs)
     if sum_prob < 1 and last:
-        scenario_probs.append((zeros(len(distribution)), 1 - sum_prob))        
+        failed = np.vstack([failed, np.ones((1, n), dtype=bool)])
+        probs = probs + [1 - sum_prob]
     elif sum_prob > 1 or sum_prob < 1:
-        scenario_probs = [(sp[0], sp[1]/sum_prob) for sp in scenario_probs]
-    return scenario_probs
+        probs = [prob/sum_prob for prob in probs]
+    return failed, np.array(probs, dtype=float)
 
+def subscenarios(distribution, cutoff, first=True, last=True):
+    failed, probs = subscenario_matrix(distribution, cutoff, first, last)
+    return list(zip((~failed).astype(int).tolist(), probs.tolist()))
 
-def weibull_probs(num, shape=.8, scale=.0001):
+
+def weibull_probs(num, shape=.8, scale=.0001, rng=None):
 #def weibull_probs(num, shape=.8, scale=.1):
+    # rng is a numpy Generator for reproducible draws; defaults to np.random
+    rng = np.random if rng is None else rng
     def xv(z):
         return scale * pow(z, 1 / shape)
-    return [xv(np.random.exponential()) for _ in range(num)]
+    return [xv(rng.exponential()) for _ in range(num)]
+
+
+class ScenarioSet:
+    #
+    # Failure scenarios over the undirected links of a network:
+    # links      - links in matrix column order
+    # link_index - directed edge -> column; both directions share a column
+    # failed     - boolean (scenarios x links) matrix, True = link down
+    # probs      - probability of each scenario
+    #
+    def __init__(self, links, failed, probs):
+        assert failed.shape == (len(probs), len(links))
+        self.links = links
+        self.link_index = {}
+        for idx, (a, b) in enumerate(links):
+            self.link_index[(a, b)] = idx
+            self.link_index[(b, a)] = idx
+        self.failed = failed
+        self.probs = probs
+
+    def __len__(self):
+        return len(self.probs)
+
+    def tunnel_incidence(self, tunnels):
+        # Sparse (tunnels x links) matrix of the links on each tunnel path
+        rows, cols = [], []
+        for row, tunnel in enumerate(tunnels):
+            for edge in tunnel.path:
+                assert edge.e in self.link_index
+                rows.append(row)
+                cols.append(self.link_index[edge.e])
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                 shape=(len(tunnels), len(self.links)))
+
+    def tunnels_down(self, tunnels):
+        # Sparse (scenarios x tunnels) matrix, nonzero where a tunnel
+        # crosses a failed link: availability for every scenario at once.
+        down = sparse.csr_matrix(self.failed, dtype=float) @ self.tunnel_incidence(tunnels).T
+        down = sparse.csr_matrix(down)
+        down.eliminate_zeros()
+        # The product leaves the column indices of a row in arbitrary order
+        down.sort_indices()
+        return down
+
+def loss_groups(network, scenarios):
+    #
+    # Group scenarios that lose the same tunnels. Only tunnels of demands
+    # with traffic matter, so scenarios that differ elsewhere have identical
+    # loss constraints and share one slack with their summed probability.
+    # Returns (probability, signatures) per group, where signatures holds
+    # (demand, ids of its tunnels that are down) for each demand that lost
+    # a tunnel, or is None when some demand loses all of its tunnels: that
+    # demand's loss is 1, which bounds every other demand's loss.
+    #
+    tunnels = list(network.tunnels.values())
+    down = scenarios.tunnels_down(tunnels)
+    demands = [d for d in network.demands.values() if d.amount != 0]
+    used = set(t.id for d in demands for t in d.tunnels)
 
+    groups = {}
+    for i, prob in enumerate(scenarios.probs.tolist()):
+        key = tuple(sorted(t for t in down.indices[down.indptr[i]:down.indptr[i + 1]].tolist()
+                           if t in used))
+        if key in groups:
+            groups[key][0] += prob
+        else:
+            groups[key] = [prob, key]
 
-def teavar(model, network, beta, scenario_probs):
+    result = []
+    for prob, key in groups.values():
+        tunnels_down = set(key)
+        signatures = []
+        for d in demands:
+            signature = tuple(t.id for t in d.tunnels if t.id in tunnels_down)
+            if len(signature) == len(d.tunnels):
+                signatures = None
+                break
+            if signature:
+                signatures.append((d, signature))
+        result.append((prob, signatures))
+    return result
+
+def teavar(model, network, beta, scenarios):
+    alpha, _ = teavar_model(model, network, beta, scenarios)
+    return alpha
+
+def set_beta(qs, beta):
+    # Change beta in place: only the slack objective coefficients depend on it
+    for prob, slack in qs:
+        slack.Obj = prob / (1.0 - beta)
+
+def teavar_model(model, network, beta, scenarios):
+    # The TeaVaR formulation; returns alpha and the (probability, slack) pairs
     import helper
-    from gurobipy import GRB
+    from solver import GRB, quicksum
     alpha = model.addVar(lb = 0, name = "alpha")
-
-    # A tunnel is enabled if all edges on tunnel are enabled under scenario
-    def enabled(scenario, t):
-        return all(scenario[edge.e] for edge in t.path)
+    groups = loss_groups(network, scenarios)
 
     #
-    # Assemble the following triples into qs:
-    # - scenario map - it makes each edge into True or False.    
-    # - probability  - probability of scenario
-    # - slack        - a slack variable representing scenario
+    # Assemble the following pairs into qs:
+    # - probability  - probability of the scenarios in a group
+    # - slack        - a slack variable representing the group
     #
-    sp = scenario_probs
-    qs = [(sp[i][0], sp[i][1], model.addVar(name = f"slack{i}", lb = 0)) for i in range(len(sp))]
+    qs = [(prob, model.addVar(name = f"slack{i}", lb = 0)) for i, (prob, _) in enumerate(groups)]
     model.update()
-    # for (scenario, prob, slack) in qs:
-    #     print(prob, slack)
         
     # F_beta constraints:
-    f_beta = alpha + (1.0 / (1.0 - beta)) * sum(prob * slack for (scenario, prob, slack) in qs)
+    f_beta = alpha + (1.0 / (1.0 - beta)) * sum(prob * slack for (prob, slack) in qs)
 
     # The objective is f_beta
     model.setObjective(f_beta, GRB.MINIMIZE)
-        
+
+    def loss(d, signature):
+        lost = set(signature)
+        return 1.0 - (1.0 / d.amount)*quicksum(t.v_flow for t in d.tunnels if t.id not in lost)
+
+    #
+    # A demand's loss only grows when it loses tunnels, so every slack is
+    # at least the largest no-failure loss. That bound is built once, as
+    # full >= loss - alpha for every demand, and each group adds
+    # slack >= full plus constraints for the demands that lost tunnels.
+    # Those expressions repeat across groups too: ones shared by several
+    # groups are likewise bound once by an auxiliary variable.
+    #
+    demands = [d for d in network.demands.values() if d.amount != 0]
+    full = model.addVar(lb = -GRB.INFINITY, name = "full_loss")
+    for d in demands:
+        model.addConstr(full >= loss(d, ()) - alpha)
+    uses = {}
+    for _, signatures in groups:
+        for d, signature in signatures or []:
+            uses[(d.id, signature)] = uses.get((d.id, signature), 0) + 1
+    shared = {}
+
     # Add inequalities for slack variables that are used to define f_beta:
-    for (scenario, prob, slack) in qs:
-        for edge in scenario:
-            assert edge in network.edges
-        for d in network.demands.values():
-            if d.amount == 0: continue
-            t_dq = 1.0 - (1.0 / d.amount)*sum(t.v_flow for t in d.tunnels if enabled(scenario, t))
-            model.addConstr(slack >= t_dq - alpha)
+    for (prob, slack), (_, signatures) in zip(qs, groups):
+        if signatures is None:
+            model.addConstr(slack >= 1.0 - alpha)
+            continue
+        model.addConstr(slack >= full)
+        for d, signature in signatures:
+            key = (d.id, signature)
+            if uses[key] == 1:
+                model.addConstr(slack >= loss(d, signature) - alpha)
+                continue
+            if key not in shared:
+                shared[key] = model.addVar(lb = -GRB.INFINITY, name = f"loss{len(shared)}")
+                model.addConstr(shared[key] >= loss(d, signature) - alpha)
+            model.addConstr(slack >= shared[key])
+    print(f"TeaVaR: {len(scenarios)} scenarios in {len(groups)} groups, "
+          f"{len(shared)} shared loss expressions")
             
     # Capacity constraints:
     helper.flow_conservation_constraints(network, model)    
     helper.edge_capacity_constraints(network, model)    
     helper.wavelength_integrality_constraints(network, model)
-    return alpha
+    return alpha, qs
 
-# Convert scenario vectors to a map from edges to whether they are enabled
-def init_scenario_map(edges, scenario_probs):
-    index = 0
-    e2idx = {}
-    assert all(len(sp[0]) == len(edges)/2 for sp in scenario_probs)
-    
-    for (a, b) in edges:
-        if (a, b) in e2idx:
-            continue
-        e2idx[(a, b)] = index
-        e2idx[(b, a)] = index
-        index += 1
-    return [({edge : sp[0][e2idx[edge]] == 1 for edge in edges}, sp[1])
-            for sp in scenario_probs]
+# Bump when the scenario generation changes so stale cache entries miss
+SCENARIO_CACHE_VERSION = 1
 
-def init_scenarios(network, cutoff):
+def init_scenarios(network, cutoff, seed, shape=.8, scale=.0001, use_cache=True):
     #
-    # 1. initialize a distribution
+    # 1. initialize a distribution over the network's links, drawn from seed
     # 2. extract a set of failure scenarios using cutoffs
-    # 3. represent the scenarios as mapping edges to failure modes
+    # 3. represent the scenarios as a (scenarios x links) failure matrix
     #
-    edges = { edge.e for edge in network.edges.values() }
-    edges |= { (a, b) for (b, a) in edges }
-    num_edges      = int(len(edges) / 2)
-    distribution   = weibull_probs(num_edges)
-    scenario_probs = subscenarios(distribution, cutoff)
-    scenario_probs = init_scenario_map(edges, scenario_probs)
-    return scenario_probs
+    # The same seed always gives the same scenario set; sets are cached on
+    # disk keyed by the links and every generation parameter.
+    #
+    import helper
+    links = helper.network_links(network)
+    key = cache.cache_key(SCENARIO_CACHE_VERSION, links, seed, cutoff, shape, scale)
+    scenarios = cache.load("scenarios", key) if use_cache else None
+    if scenarios is not None:
+        return scenarios
+    distribution   = weibull_probs(len(links), shape, scale, np.random.default_rng(seed))
+    failed, probs  = subscenario_matrix(distribution, cutoff)
+    scenarios = ScenarioSet(links, failed, probs)
+    if use_cache:
+        cache.store("scenarios", key, scenarios)
+    return scenarios
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("graph_tool.all")
+
+import failure_engine
+from solver import GRB
+from NetworkTopology import *
+
+def square_network():
+    network = Network("square")
+    for a, b in (("A", "B"), ("B", "C"), ("C", "D"), ("D", "A")):
+        network.add_edge(a, b, 100, 400)
+        network.add_edge(b, a, 100, 400)
+    network.add_demand("A", "C", 10)
+    network.add_tunnel(["A", "B", "C"])
+    network.add_tunnel(["A", "D", "C"])
+    network.add_demand("C", "A", 10)
+    network.add_tunnel(["C", "B", "A"])
+    network.add_tunnel(["C", "D", "A"])
+    return network
+
+def test_engine_keeps_its_own_variables():
+    network = square_network()
+    engine = failure_engine.max_flow_engine(network)
+    # A second model over the same network replaces tunnel.v_flow
+    failure_engine.max_flow_engine(network)
+    assert engine.solve([("A", "B")]) == (GRB.OPTIMAL, 20)
+    assert engine.solve([("A", "B"), ("A", "D")]) == (GRB.OPTIMAL, 0)
+    assert engine.solve([]) == (GRB.OPTIMAL, 20)
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("graph_tool.all")
+
+import helper
+from NetworkTopology import *
+
+def diamond_network():
+    # TeaVaR topologies carry no distances, so every path ties at 0.0
+    network = Network("diamond")
+    for a, b in (("S", "B"), ("S", "A"), ("A", "V"), ("B", "V")):
+        network.add_edge(a, b, 100, 400)
+        network.add_edge(b, a, 100, 400)
+    return network
+
+def test_zero_distance_shortcuts_match_all_shortest_paths():
+    network = diamond_network()
+    helper.init_graph(network)
+    G = network.graph
+    shortcut_node_pairs = helper.init_shortcuts(network, nhops=3)
+    assert shortcut_node_pairs[("S", "V")].pathstr == "S:A:V"
+    assert shortcut_node_pairs[("B", "A")].pathstr == "B:S:A"
+    seen = set()
+    for (mkt_1, mkt_2), shortcut in shortcut_node_pairs.items():
+        seen.add((mkt_1, mkt_2))
+        # The reverse of an earlier shortcut is mirrored, not searched
+        if (mkt_2, mkt_1) in seen: continue
+        shortcut_str, shortcut_distance = helper.shortest_path_by_distance(
+            G, helper.market_vertex(G, mkt_1), helper.market_vertex(G, mkt_2), 3)
+        assert shortcut.pathstr == shortcut_str
+        assert shortcut.distance == shortcut_distance
@@ -0,0 +1,43 @@
+import numpy as np
+from scipy import sparse
+from NetworkTopology import *
+import teavar
+
+def triangle_network():
+    # Demand A->C with tunnels A:B:C and A:C
+    network = Network("triangle")
+    for a, b in (("A", "B"), ("B", "C"), ("A", "C")):
+        network.add_edge(a, b, 100, 100)
+        network.add_edge(b, a, 100, 100)
+    network.add_demand("A", "C", 10)
+    network.add_tunnel(["A", "B", "C"])
+    network.add_tunnel(["A", "C"])
+    return network
+
+class UnsortedScenarios:
+    # Two scenarios with the same down tunnels, stored in opposite orders
+    def __init__(self, down):
+        self.down = down
+        self.probs = np.array([0.25, 0.5])
+
+    def tunnels_down(self, tunnels):
+        return self.down
+
+def test_loss_groups_merge_scenarios_in_any_index_order():
+    network = triangle_network()
+    ids = [t.id for t in network.tunnels.values()]
+    assert len(ids) == 2
+    down = sparse.csr_matrix((np.ones(4), np.array(ids + ids[::-1]), np.array([0, 2, 4])),
+                             shape=(2, len(ids)))
+    assert not down.has_sorted_indices
+    groups = teavar.loss_groups(network, UnsortedScenarios(down))
+    assert len(groups) == 1
+    assert groups[0][0] == 0.75
+
+def test_tunnels_down_sorts_indices():
+    network = triangle_network()
+    links = [("A", "B"), ("B", "C"), ("A", "C")]
+    scenarios = teavar.ScenarioSet(links, np.array([[False, True, True], [True, False, True]]),
+                                   np.array([0.5, 0.5]))
+    down = scenarios.tunnels_down(list(network.tunnels.values()))
+    assert down.has_sorted_indices
@@ -0,0 +1,40 @@
+from NetworkTopology import *
+
+def square_network():
+    network = Network("square")
+    for a, b in (("A", "B"), ("B", "C"), ("C", "D"), ("D", "A")):
+        network.add_edge(a, b, 100, 400)
+        network.add_edge(b, a, 100, 400)
+    network.add_demand("A", "C", 10)
+    network.add_tunnel(["A", "B", "C"])
+    network.add_tunnel(["A", "D", "C"])
+    network.add_tunnel(["B", "C", "D"])
+    network.add_shortcut(["A", "B", "C"], 100, 500.0)
+    return network
+
+def test_views_follow_the_arrays():
+    network = square_network()
+    tunnel = network.tunnels["A:B:C"]
+    assert [edge.e for edge in tunnel.path] == [("A", "B"), ("B", "C")]
+    assert [t.pathstr for t in network.edges[("B", "C")].tunnels] == ["A:B:C", "B:C:D"]
+    assert [t.pathstr for t in network.demands[("A", "C")].tunnels] == ["A:B:C", "A:D:C"]
+    assert [t.pathstr for t in network.shortcuts["A:B:C"].tunnels] == ["A:B:C"]
+    assert [s.pathstr for s in tunnel.shortcuts] == ["A:B:C"]
+    assert "A:C" not in network.tunnels
+    assert network.tunnels["A:B:C"] == tunnel
+
+def test_scenario_copy_shares_topology_not_variables():
+    network = square_network()
+    copy = network.scenario_copy()
+    assert copy.topology is network.topology
+    network.tunnels["A:B:C"].v_flow = "base"
+    copy.tunnels["A:B:C"].v_flow = "copy"
+    assert network.tunnels["A:B:C"].v_flow == "base"
+    assert network.tunnels["A:B:C"] != copy.tunnels["A:B:C"]
+
+def test_deleted_demand_is_gone():
+    network = square_network()
+    network.add_demand("B", "D", 5)
+    del network.demands[("B", "D")]
+    assert ("B", "D") not in network.demands
+    assert list(network.demands) == [("A", "C")]